@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do Gmail to Telegram Forwarder
+Mede custo de CPU e memória das etapas de processamento sem acessar Gmail ou Telegram
+
+Uso:
+    python benchmark.py            # executa todos os benchmarks
+    python benchmark.py memoria    # executa apenas os benchmarks indicados
+"""
+
+import re
+import sys
+import json
+import time
+import base64
+import random
+import logging
+import tracemalloc
+from concurrent.futures import Future
+
+import gmail_telegram_forwarder as gtf
+
+WORDS = (
+    "reunião projeto relatório pedido cliente fatura prazo entrega equipe "
+    "servidor alerta backup contrato proposta orçamento status semana "
+    "meeting report invoice deadline update review release deploy"
+).split()
+
+def print_header(title):
+    """Imprime cabeçalho de um benchmark"""
+    print()
+    print("=" * 60)
+    print(f"📊 {title}")
+    print("=" * 60)
+
+def timeit(func, repeat=5, number=1000):
+    """Retorna o melhor tempo médio (em microssegundos) por chamada"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+def random_text(rng, words=400):
+    """Gera um texto pseudo-aleatório com quebras de linha"""
+    lines = []
+    for _ in range(max(1, words // 12)):
+        lines.append(' '.join(rng.choice(WORDS) for _ in range(12)) + '.')
+    return '\n'.join(lines)
+
+def encode(text):
+    """Codifica texto como o campo 'data' da Gmail API"""
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+def sample_message(rng, index, words=400):
+    """Gera uma mensagem no formato 'full' da Gmail API"""
+    body = random_text(rng, words)
+    headers = [
+        {'name': 'Received', 'value': f'from mail{index}.example.com by mx.google.com with ESMTPS id {index}'},
+        {'name': 'Received', 'value': f'by 2002:a05:{index} with SMTP id {index}; Mon, 15 Jan 2024 14:30:00 -0800'},
+        {'name': 'DKIM-Signature', 'value': 'v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; ' + 'b=' + 'A' * 344},
+        {'name': 'ARC-Seal', 'value': 'i=1; a=rsa-sha256; t=1705329000; cv=none; d=google.com; b=' + 'B' * 344},
+        {'name': 'From', 'value': f'=?UTF-8?B?{base64.b64encode("João Silva".encode()).decode()}?= <joao{index % 50}@empresa.com>'},
+        {'name': 'To', 'value': 'eu@gmail.com'},
+        {'name': 'Subject', 'value': f'Relatório semanal #{index}'},
+        {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        {'name': 'Message-ID', 'value': f'<{index}@empresa.com>'},
+        {'name': 'MIME-Version', 'value': '1.0'},
+        {'name': 'Content-Type', 'value': 'multipart/mixed; boundary="000000000000abcdef"'},
+    ]
+    return {
+        'id': f'msg{index:06d}',
+        'sizeEstimate': len(body) * 2,
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': headers,
+            'parts': [
+                {'mimeType': 'multipart/alternative', 'filename': '', 'body': {'size': 0}, 'parts': [
+                    {'mimeType': 'text/plain', 'filename': '', 'body': {'data': encode(body)}},
+                    {'mimeType': 'text/html', 'filename': '',
+                     'body': {'data': encode('<html><body><p>' + body.replace('\n', '</p><p>') + '</p></body></html>')}},
+                ]},
+                {'mimeType': 'application/pdf', 'filename': f'relatorio{index}.pdf',
+                 'body': {'size': 120000, 'attachmentId': f'att{index}'}},
+            ],
+        },
+    }
+
+SAMPLE_CONFIG = {
+    "telegram": {"bot_token": "TOKEN", "chat_id": "0"},
+    "gmail": {"credentials_file": "credentials.json", "token_file": "token.pickle"},
+    "filters": {
+        "from_addresses": [],
+        "subject_keywords": [],
+        "body_keywords": [],
+        "exclude_keywords": ["noreply", "no-reply"],
+        "max_age_hours": 24
+    },
+    "settings": {
+        "check_interval_seconds": 300,
+        "include_attachments": True,
+        "max_message_length": 4000,
+        "send_full_email": True
+    }
+}
+
+def offline_forwarder(overrides=None):
+    """Cria um forwarder sem autenticar no Gmail (apenas para medições)"""
+    config = json.loads(json.dumps(SAMPLE_CONFIG))
+    for section, values in (overrides or {}).items():
+        config[section].update(values)
+    forwarder = object.__new__(gtf.GmailTelegramForwarder)
+    forwarder.config = config
+    forwarder.gmail_service = None
+    forwarder.parse_pool = None
+    forwarder.config_watcher = None
+    forwarder.compile_config()
+    return forwarder
+
+class FakeGmailService:
+    """Simula ``users().messages().get()`` com latência de rede fixa"""
+
+    def __init__(self, messages, latency):
+        self.by_id = {message['id']: message for message in messages}
+        self.latency = latency
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, format='full'):
+        self.current = self.by_id[id]
+        return self
+
+    def execute(self):
+        time.sleep(self.latency)
+        return self.current
+
+def reply_chain(rng, depth, words=60):
+    """Gera uma cadeia de respostas com citações, assinaturas e separadores"""
+    body = random_text(rng, words)
+    for level in range(depth):
+        quoted = '\n'.join('> ' + line if line else '>' for line in body.split('\n'))
+        style = level % 3
+        if style == 0:
+            header = f"Em seg., {level + 1} de jan. de 2024 às 14:30, Pessoa {level} <p{level}@empresa.com> escreveu:"
+        elif style == 1:
+            header = f"On Mon, Jan {level + 1}, 2024 at 2:30 PM Person {level} <p{level}@example.com> wrote:"
+        else:
+            header = f"________________________________\nDe: Pessoa {level}\nEnviado: segunda-feira\nAssunto: RE: Projeto"
+            quoted = body
+        signature = f"-- \nPessoa {level + 1}\nEquipe de Projetos"
+        body = f"{random_text(rng, words)}\n\n{signature}\n\n{header}\n{quoted}"
+    return body
+
+def benchmark_trimming():
+    """Remoção de citações/assinaturas em cadeias de respostas"""
+    print_header("Remoção de citações em cadeias de respostas (500 emails)")
+    rng = random.Random(7)
+    corpus = [reply_chain(rng, depth=rng.randint(1, 8)) for _ in range(500)]
+    trimmer = gtf.ReplyTrimmer()
+
+    start = time.perf_counter()
+    trimmed = [trimmer.trim(body) for body in corpus]
+    elapsed = time.perf_counter() - start
+
+    original_chars = sum(len(body) for body in corpus)
+    trimmed_chars = sum(len(body) for body in trimmed)
+    print(f"Trim:                 {elapsed / len(corpus) * 1e6:8.1f} µs/email")
+    print(f"Tamanho do corpo:     {original_chars / len(corpus):8.0f} → "
+          f"{trimmed_chars / len(corpus):.0f} caracteres/email")
+
+    records = []
+    for index, body in enumerate(corpus):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': 'Pessoa <p@empresa.com>'},
+            {'name': 'Subject', 'value': 'RE: RE: Projeto'},
+            {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        ])
+        record._body = body
+        record._attachments = []
+        records.append(record)
+
+    for label, trimming in (("sem trim", False), ("com trim", True)):
+        forwarder = offline_forwarder({'settings': {'trimming': trimming}})
+        cost = timeit(lambda: [forwarder.format_telegram_message(r) for r in records], repeat=3, number=3)
+        print(f"Formatação {label}:  {cost / len(records):8.1f} µs/email")
+
+def large_html_message(rng, index, paragraphs):
+    """Gera uma mensagem HTML grande (newsletter/relatório)"""
+    html = ''.join(
+        f'<div class="p{i}"><p style="margin:0"><span><b>{random_text(rng, 30)}</b></span></p></div>'
+        for i in range(paragraphs))
+    return {
+        'id': f'big{index:04d}',
+        'sizeEstimate': len(html),
+        'payload': {
+            'mimeType': 'text/html',
+            'headers': [{'name': 'From', 'value': 'news@empresa.com'},
+                        {'name': 'Subject', 'value': f'Relatório #{index}'}],
+            'body': {'data': encode(html)},
+        },
+    }
+
+def benchmark_attachments():
+    """Regras de anexos: classificação só com metadados (e conferência das regras)"""
+    print_header("Regras de anexos (classificação por metadados)")
+    options = gtf.AttachmentOptions.from_settings({'attachment_rules': [
+        {'name': 'assinatura', 'filenames': ['logo.png', 'banner*'], 'action': 'skip'},
+        {'name': 'convites', 'extensions': ['.ics'], 'action': 'skip'},
+        {'name': 'fotos grandes', 'mime_types': ['image/*'], 'min_size_kb': 5000, 'action': 'skip'},
+    ]})
+
+    def attachment(filename, mime_type='application/pdf', size=1000):
+        return {'filename': filename, 'mimeType': mime_type, 'size': size}
+
+    # Cada glob descreve o nome inteiro, inclusive quando a regra tem vários
+    expected = {
+        'logo.png': "regra 'assinatura'",
+        'banner_natal.gif': "regra 'assinatura'",
+        'logo.png.exe': None,
+        'logo.pngx_contrato.pdf': None,
+        'meu_banner.pdf': None,
+        'convite.ics': "regra 'convites'",
+    }
+    for filename, reason in expected.items():
+        assert options.skip_reason(attachment(filename)) == reason, filename
+    assert options.skip_reason(attachment('foto.jpg', 'image/jpeg', 6 * 1024 * 1024)) == "regra 'fotos grandes'"
+
+    rng = random.Random(17)
+    names = ['logo.png', 'banner1.jpg', 'relatorio.pdf', 'planilha.xlsx', 'convite.ics', 'foto.jpg']
+    attachments = [attachment(rng.choice(names), rng.choice(['application/pdf', 'image/png']),
+                              rng.randint(1, 10 * 1024 * 1024)) for _ in range(5000)]
+    cost = timeit(lambda: [options.skip_reason(item) for item in attachments], repeat=3, number=3)
+    print(f"{len(options.rules)} regras:  {cost / len(attachments):5.2f} µs por anexo")
+
+def benchmark_offload():
+    """Parsing de emails grandes no pool de processos vs na thread principal"""
+    print_header("Parsing de emails grandes: inline vs pool de processos")
+    rng = random.Random(3)
+    messages = []
+    for index in range(40):
+        if index % 4 == 0:
+            messages.append(large_html_message(rng, index, paragraphs=6000))
+        else:
+            messages.append(sample_message(rng, index))
+    size = sum(m['sizeEstimate'] for m in messages) / len(messages) / 1024
+    print(f"{len(messages)} emails, {size:.0f} KiB em média, 20 ms de latência por download")
+
+    for label, offload_kb in (("inline", 0), ("pool", 256)):
+        forwarder = offline_forwarder({'settings': {'parse_offload_kb': offload_kb, 'parse_workers': 2}})
+        forwarder.gmail_service = FakeGmailService(messages, latency=0.02)
+        if offload_kb:
+            # Aquece o pool para não medir a criação dos processos
+            list(forwarder.get_parse_pool().map(abs, range(4)))
+
+        start = time.perf_counter()
+        for message, record in forwarder.iter_email_details(messages):
+            forwarder.should_forward_email(record)
+        elapsed = time.perf_counter() - start
+        forwarder.close()
+        print(f"{label:8s} {elapsed * 1000:8.0f} ms  ({elapsed / len(messages) * 1000:.1f} ms/email)")
+
+    # Falha no pool: o email é baixado e processado de novo, nunca sai vazio
+    forwarder = offline_forwarder({'settings': {'parse_offload_kb': 256}})
+    forwarder.gmail_service = FakeGmailService(messages, latency=0)
+    failed = Future()
+    failed.set_exception(MemoryError("worker encerrado"))
+    forwarder.get_parse_pool = lambda: type('FailingPool', (), {'submit': lambda *args: failed})()
+    details = list(forwarder.iter_email_details(messages[:8]))
+    assert [message['id'] for message, record in details] == [m['id'] for m in messages[:8]]
+    assert all(record.body for message, record in details)
+    assert len(details[1][1].attachments) == 1
+
+def benchmark_keywords():
+    """Palavras-chave: laço ``keyword in text`` vs KeywordAutomaton"""
+    print_header("Busca de palavras-chave por email (corpo de ~5 mil caracteres)")
+    rng = random.Random(11)
+    text = random_text(rng, 700).lower()
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for count in (10, 50, 100, 500, 2000):
+        keywords = [''.join(rng.choice(letters) for _ in range(rng.randint(5, 12)))
+                    for _ in range(count)]
+        automaton = gtf.KeywordAutomaton(keywords)
+        naive = timeit(lambda: [k for k in keywords if k.lower() in text], repeat=3, number=20)
+        compiled = timeit(lambda: automaton.find_all(text), repeat=3, number=20)
+        mode = "autômato" if count >= automaton.AUTOMATON_MIN_KEYWORDS else "str.find"
+        print(f"{count:5d} palavras:  laço {naive:8.0f} µs   compilado {compiled:8.0f} µs  ({mode})")
+
+def benchmark_patterns():
+    """Padrões: uma alternação combinada vs um regex por regra (e equivalência)"""
+    print_header("Padrões regex/glob sobre o corpo (emails de várias linhas)")
+    rng = random.Random(13)
+    records = []
+    for index in range(300):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': f'user{index}@empresa.com'},
+            {'name': 'Subject', 'value': 'Status'},
+        ])
+        record._body = random_text(rng, 120) + ('\nURGENTE: servidor fora do ar\n' if index % 7 == 0 else '')
+        record._attachments = []
+        records.append(record)
+
+    for count in (5, 50):
+        rules = [('urgente', '*urgente*')] + [(f'g{index}', f'*{rng.choice(WORDS)}{index}*')
+                                              for index in range(count - 1)]
+        matcher = gtf.PatternMatcher('glob', 'body', rules)
+        separate = [(name, re.compile(gtf.glob_to_regex(gtf.normalize_text(glob)), re.DOTALL))
+                    for name, glob in rules]
+
+        def one_by_one(record):
+            text = record.text[record.body_start:]
+            return next((name for name, pattern in separate if pattern.fullmatch(text)), None)
+
+        # Globs casam o corpo inteiro, inclusive com quebras de linha
+        for record in records:
+            assert matcher.match(record) == one_by_one(record), record.id
+        assert sum(matcher.match(record) == 'urgente' for record in records) == len(records[::7])
+
+        combined = timeit(lambda: [matcher.match(record) for record in records], repeat=3, number=3)
+        naive = timeit(lambda: [one_by_one(record) for record in records], repeat=3, number=3)
+        print(f"{count:3d} globs:  um por regra {naive / len(records):7.1f} µs   "
+              f"combinados {combined / len(records):7.1f} µs por email")
+
+def benchmark_routing():
+    """Roteamento: índice por remetente vs avaliação de todas as regras"""
+    print_header("Roteamento por email (regras por remetente/domínio)")
+    rng = random.Random(5)
+    records = []
+    for index in range(2000):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': f'user{rng.randint(0, 5000)}@dominio{rng.randint(0, 3000)}.com'},
+            {'name': 'Subject', 'value': 'Status'},
+        ])
+        record._body = 'corpo'
+        records.append(record)
+
+    for count in (10, 100, 1000):
+        rules = []
+        for index in range(count):
+            kind = index % 3
+            if kind == 0:
+                sender = f'user{index}@dominio{index}.com'
+            elif kind == 1:
+                sender = f'@dominio{index}.com'
+            else:
+                sender = f'alerts{index}@'
+            rules.append({'name': f'r{index}', 'from': [sender], 'chat_id': str(index)})
+        config = dict(SAMPLE_CONFIG, routes=rules)
+        router = gtf.Router.compile(config)
+
+        def linear():
+            for record in records:
+                next((route for route in router.routes if route.matches(record)), router.default_route)
+
+        indexed = timeit(lambda: [router.route(record) for record in records], repeat=3, number=3)
+        scanned = timeit(linear, repeat=3, number=3)
+        print(f"{count:5d} regras:  todas {scanned / len(records):7.2f} µs   "
+              f"indexado {indexed / len(records):5.2f} µs por email")
+
+def benchmark_senders():
+    """Remetentes: SenderIndex vs lista, e tamanho da busca no Gmail"""
+    print_header("Índice de remetentes (from_addresses)")
+    rng = random.Random(9)
+    addresses = [f'user{rng.randint(0, 10**6)}@dominio{rng.randint(0, 200)}.com' for _ in range(10000)]
+    probes = [f'user{rng.randint(0, 10**6)}@mail.dominio{rng.randint(0, 400)}.com' for _ in range(1000)]
+
+    for count in (10, 1000, 10000):
+        patterns = addresses[:count] + ['*.dominio7.com', '@empresa.com.br']
+        index = gtf.SenderIndex(patterns)
+        lookup = timeit(lambda: [index.matches(address) for address in probes], repeat=3, number=3)
+        scan = timeit(lambda: [any(address == pattern for pattern in patterns) for address in probes],
+                      repeat=3, number=1)
+        query = index.gmail_query()
+        query = f"{len(query)} caracteres" if query else "só no cliente"
+        print(f"{count:6d} remetentes:  lista {scan / len(probes):8.2f} µs   índice "
+              f"{lookup / len(probes):5.2f} µs   busca: {query}")
+
+    # O preparo do texto não é medido: a verificação de remetente segue antes
+    # das de texto mesmo quando elas rejeitam mais e parecem mais baratas
+    forwarder = offline_forwarder({'filters': {'from_addresses': addresses, 'exclude_keywords': ['cpu']}})
+    for index in range(gtf.CheckSchedule.REORDER_INTERVAL * 2):
+        subject, body = alert_email(rng, index)
+        record = gtf.EmailRecord(f'msg{index}', [{'name': 'From', 'value': addresses[index]},
+                                                 {'name': 'Subject', 'value': subject}])
+        record._body = body * 20
+        assert not forwarder.filter_set.evaluate(record).forward
+    assert [check.needs_text for check in forwarder.filter_set.schedule.checks] == [False, True]
+
+def benchmark_normalization():
+    """Normalização: caminho ASCII vs texto acentuado"""
+    print_header("Normalização de texto (corpo de ~5 mil caracteres)")
+    rng = random.Random(13)
+    accented = random_text(rng, 700)
+    ascii_text = gtf.normalize_text(accented)
+    for label, text in (("ASCII", ascii_text), ("acentuado", accented)):
+        lower = timeit(lambda: text.lower(), repeat=3, number=200)
+        normalized = timeit(lambda: gtf.normalize_text(text), repeat=3, number=200)
+        print(f"{label:10s} lower() {lower:7.1f} µs   normalize_text {normalized:7.1f} µs")
+
+def alert_email(rng, index):
+    """Gera um alerta de monitoramento com valores variáveis"""
+    host = f"srv{index % 3}"
+    return (f"alerta cpu alta em {host}",
+            f"o servidor {host} ultrapassou o limite de cpu. valor atual {rng.randint(85, 99)}% "
+            f"as {rng.randint(0, 23)}:{rng.randint(0, 59):02d}. verifique os processos em execucao, "
+            f"a fila de jobs e o uso de memoria. este alerta sera repetido enquanto a condicao "
+            f"persistir. painel: https://monitor.example.com/hosts/{host} id {index}"
+            f"{' (reincidente)' if index % 2 else ''}")
+
+def naive_simhash(text):
+    """SimHash percorrendo os 64 bits de cada shingle"""
+    words = gtf.WORD.findall(gtf.DIGITS.sub('0', text))
+    shingles = set(' '.join(words[i:i + 3]) for i in range(len(words) - 2))
+    counters = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(gtf.hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        for bit in range(64):
+            counters[bit] += 1 if value >> bit & 1 else -1
+    # Mesma ordem de bits de gtf.simhash (bytes little-endian)
+    return sum(1 << bit for bit in range(64) if counters[bit] > 0)
+
+def benchmark_duplicates():
+    """Deduplicação: custo do SimHash e da busca na janela"""
+    print_header("Emails quase idênticos (SimHash)")
+    rng = random.Random(17)
+    alerts = [' '.join(alert_email(rng, index)) for index in range(200)]
+    others = [random_text(rng, 120) for _ in range(200)]
+
+    text = others[0]
+    packed = timeit(lambda: gtf.simhash(text), repeat=3, number=200)
+    naive = timeit(lambda: naive_simhash(text), repeat=3, number=50)
+    print(f"impressão (~120 palavras): bit a bit {naive:6.0f} µs   empacotado {packed:6.0f} µs")
+
+    assert naive_simhash(text) == gtf.simhash(text)
+    alert_prints = [gtf.simhash(text) for text in alerts[::3]]
+    other_prints = [gtf.simhash(text) for text in others]
+    similar = sorted(gtf.hamming_distance(alert_prints[0], value) for value in alert_prints[1:])
+    different = sorted(gtf.hamming_distance(a, b) for a, b in zip(other_prints, other_prints[1:]))
+    print(f"distância entre alertas repetidos: mediana {similar[len(similar) // 2]}, máx {similar[-1]}   "
+          f"entre emails distintos: mediana {different[len(different) // 2]}, mín {different[0]}")
+
+    for count in (100, 1000, 5000):
+        index = gtf.DuplicateIndex(max_distance=6, max_entries=count)
+        fingerprints = [rng.getrandbits(64) for _ in range(count)]
+        for value in fingerprints:
+            index.add(value, 'chat', 'x', now=0)
+        probes = [rng.getrandbits(64) for _ in range(1000)]
+        indexed = timeit(lambda: [index.find(value, 'chat', now=0) for value in probes], repeat=3, number=1)
+        scan = timeit(lambda: [any(gtf.hamming_distance(value, other) <= 6 for other in fingerprints)
+                               for value in probes], repeat=3, number=1)
+        print(f"{count:5d} na janela:  varredura {scan / len(probes):8.2f} µs   "
+              f"faixas {indexed / len(probes):5.2f} µs por email")
+
+    # Recarregar a configuração com outros parâmetros não perde histórico nem retidos
+    forwarder = offline_forwarder({'settings': {'deduplicate': True, 'throttle': {'max_messages': 1}}})
+    forwarder.duplicate_index.add(alert_prints[0], 'chat', 'alerta')
+    assert forwarder.duplicate_index.find(alert_prints[1], 'chat') is not None
+    assert forwarder.sender_throttle.allow('a@x.com', 'A <a@x.com>', 'chat', 'um')
+    assert not forwarder.sender_throttle.allow('a@x.com', 'A <a@x.com>', 'chat', 'dois')
+    config = json.loads(json.dumps(forwarder.config))
+    config['settings']['deduplicate'] = {'max_distance': 8}
+    config['settings']['throttle'] = {'max_messages': 2}
+    forwarder.apply_runtime(forwarder.build_runtime(config))
+    assert [count for entry, count in forwarder.duplicate_index.pending_reports()] == [1]
+    assert forwarder.duplicate_index.find(alert_prints[2], 'chat') is not None
+    assert forwarder.sender_throttle.windows['a@x.com'].held_count == 1
+    assert forwarder.sender_throttle.windows['a@x.com'].limit[0] == 2
+
+def benchmark_priority():
+    """Prioridade: pontuação de um lote em Python puro vs NumPy"""
+    print_header("Pontuação de prioridade (lote de 5000 emails)")
+    rng = random.Random(19)
+    records = []
+    for index in range(5000):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': f'user{rng.randint(0, 500)}@dominio{rng.randint(0, 100)}.com'},
+            {'name': 'Subject', 'value': ' '.join(rng.choice(WORDS) for _ in range(6))},
+        ], labels=rng.sample(['INBOX', 'IMPORTANT', 'CATEGORY_UPDATES', 'CATEGORY_PROMOTIONS'], 2))
+        record._body = ''
+        records.append(record)
+    weights = {f"subject:{word}": rng.uniform(-2, 2) for word in WORDS}
+    weights.update({f"domain:dominio{index}.com": rng.uniform(-2, 2) for index in range(100)})
+    weights['label:IMPORTANT'] = 3.0
+    scorer = gtf.PriorityScorer(weights)
+
+    features = timeit(lambda: [gtf.priority_features(record) for record in records], repeat=3, number=1)
+    batch = timeit(lambda: scorer.score_batch(records), repeat=3, number=1)
+    mode = "NumPy" if gtf.numpy is not None else "Python puro"
+    print(f"atributos {features / 1000:7.1f} ms   atributos + pontuação ({mode}) {batch / 1000:7.1f} ms   "
+          f"({len(records) / batch * 1e6:,.0f} emails/s)")
+
+    if gtf.numpy is not None:
+        numpy, gtf.numpy = gtf.numpy, None
+        try:
+            pure = timeit(lambda: gtf.PriorityScorer(weights).score_batch(records), repeat=3, number=1)
+        finally:
+            gtf.numpy = numpy
+        print(f"mesma pontuação em Python puro {pure / 1000:7.1f} ms")
+
+def legacy_escape_markdown(text):
+    """Reproduz o escape anterior (18 passadas de str.replace)"""
+    if not text:
+        return ""
+    special_chars = ['_', '*', '`', '[', ']', '(', ')', '~', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+    for char in special_chars:
+        text = text.replace(char, f'\\{char}')
+    return text
+
+def benchmark_escape():
+    """Escape do MarkdownV2: versão anterior vs atual vs passada única (translate/regex)"""
+    print_header("Escape de MarkdownV2")
+    rng = random.Random(23)
+    forwarder = offline_forwarder()
+    specials = gtf.MARKDOWN_SPECIAL_CHARS + '\\'
+    table = str.maketrans(dict(gtf.MARKDOWN_ESCAPES))
+    pattern = gtf.re.compile('[' + gtf.re.escape(''.join(char for char, _ in gtf.MARKDOWN_ESCAPES)) + ']')
+    for size in (60, 4000, 20000):
+        text = ''.join(rng.choice(specials) if rng.random() < 0.08 else rng.choice('abcdefghij áé\n')
+                       for _ in range(size))
+        # A versão atual também escapa a barra invertida
+        expected = legacy_escape_markdown(text.replace('\\', '\\\\'))
+        assert forwarder.escape_markdown(text) == expected
+        assert text.translate(table) == expected and pattern.sub(r'\\\g<0>', text) == expected
+        number = max(10, 200000 // size)
+        legacy = timeit(lambda: legacy_escape_markdown(text), repeat=3, number=number)
+        current = timeit(lambda: forwarder.escape_markdown(text), repeat=3, number=number)
+        translated = timeit(lambda: text.translate(table), repeat=3, number=number)
+        regex = timeit(lambda: pattern.sub(r'\\\g<0>', text), repeat=3, number=number)
+        print(f"{size:6d} caracteres:  anterior {legacy:7.1f} µs   atual {current:7.1f} µs   "
+              f"translate {translated:7.1f} µs   regex {regex:7.1f} µs")
+
+def benchmark_render():
+    """Formatação da mensagem em MarkdownV2 vs HTML"""
+    print_header("Renderização: MarkdownV2 vs HTML")
+    rng = random.Random(29)
+    records = []
+    for index in range(500):
+        subject, body = alert_email(rng, index)
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': f'Monitor <alertas-{index % 7}@monitor.example.com>'},
+            {'name': 'Subject', 'value': f'[ALERTA] {subject} (#{index})'},
+            {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        ])
+        record._body = body + '\n\n' + random_text(rng, 200)
+        record._attachments = [{'filename': f'relatorio-{index}.pdf', 'size': 1536000 + index}]
+        records.append(record)
+
+    for parse_mode in gtf.RENDERERS:
+        forwarder = offline_forwarder({'telegram': {'parse_mode': parse_mode}})
+        messages = [forwarder.format_telegram_message(record) for record in records]
+        cost = timeit(lambda: [forwarder.format_telegram_message(r) for r in records], repeat=3, number=3)
+        added = sum(message.count('\\') if parse_mode == 'MarkdownV2' else message.count('&')
+                    for message in messages) / len(messages)
+        print(f"{parse_mode:10s} {cost / len(records):8.1f} µs/email   {added:6.1f} escapes/email")
+
+def benchmark_validation():
+    """Validação local do MarkdownV2 antes do envio"""
+    print_header("Validação de MarkdownV2")
+    rng = random.Random(31)
+    forwarder = offline_forwarder()
+    renderer = gtf.RENDERERS['MarkdownV2']
+    messages = []
+    for index in range(500):
+        subject, body = alert_email(rng, index)
+        body += '\n\n' + random_text(rng, 200)
+        # Template com marcação válida e um em cada quatro com erros de escrita
+        template = "🚨 *{subject}*\n_{date}_\n\n{body}"
+        if index % 4 == 0:
+            template = rng.choice(("🚨 *{subject}\n\n{body}", "Alerta (monitor): {subject}\n{body}",
+                                   "`{subject}\n\n{body}", "*{subject}* _{date}\n{body}"))
+        messages.append(template.format(subject=renderer.escape(subject), date=renderer.escape('15/01/2024'),
+                                        body=renderer.escape(body)))
+
+    logging.disable(logging.CRITICAL)
+    try:
+        prepared = [renderer.prepare(message) for message in messages]
+        cost = timeit(lambda: [renderer.prepare(message) for message in messages], repeat=3, number=1)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    repaired = sum(1 for message, (text, mode) in zip(messages, prepared) if mode and text != message)
+    plain = sum(1 for _, mode in prepared if mode is None)
+    average = sum(len(message) for message in messages) / len(messages)
+    print(f"{len(messages)} mensagens de {average:.0f} caracteres: {cost / len(messages):7.1f} µs/mensagem")
+    print(f"válidas {len(messages) - repaired - plain}   corrigidas {repaired}   texto simples {plain}   "
+          f"(1 requisição cada; antes, as inválidas custavam 2)")
+
+def legacy_format_message(forwarder, record, template=None, renderer=None):
+    """Reproduz o formatador anterior (layout com += e templates com str.format)"""
+    renderer = renderer or gtf.RENDERERS['MarkdownV2']
+    escape = renderer.escape
+    bold = renderer.bold
+    max_length = forwarder.config['settings'].get('max_message_length', 4000)
+    fields = {
+        'from': escape(record.sender),
+        'subject': escape(record.subject),
+        'date': escape(record.date),
+        'body': '',
+        'attachments': forwarder.format_attachment_list(record.attachments, renderer),
+    }
+    if template is None:
+        message = f"📧 {bold('Novo Email')}\n\n"
+        message += f"{bold('De:')} {fields['from']}\n"
+        message += f"{bold('Assunto:')} {fields['subject']}\n"
+        message += f"{bold('Data:')} {fields['date']}\n\n"
+        overhead = len(message)
+    else:
+        overhead = len(template.format_map(fields))
+
+    body = forwarder.reply_trimmer.trim(record.body) if forwarder.reply_trimmer else record.body
+    body = body.strip()
+    if len(body) > (max_length - overhead - 200):
+        body = body[:max_length - overhead - 200] + "..."
+    fields['body'] = escape(body)
+    if template is None:
+        message += f"{bold('Conteúdo:')}\n{fields['body']}\n\n"
+        message += fields['attachments']
+    else:
+        message = template.format_map(fields)
+    return message[:max_length]
+
+def benchmark_templates():
+    """Templates compilados vs formatador anterior"""
+    print_header("Templates de mensagem (500 emails)")
+    rng = random.Random(37)
+    records = []
+    for index in range(500):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': f'Pessoa {index} <p{index}@empresa.com>'},
+            {'name': 'Subject', 'value': f'Relatório {index}: status (semana {index % 52})'},
+            {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        ])
+        record._body = random_text(rng, rng.choice((40, 400, 1200)))
+        record._attachments = [{'filename': f'anexo-{index}.pdf', 'size': 2048000}] if index % 3 == 0 else []
+        records.append(record)
+
+    route_template = "🚨 *{subject}*\n_{from}_\n\n{body}\n\n{attachments}"
+    for label, template in (("layout padrão", None), ("template da rota", route_template)):
+        # Sem remoção de citações, para medir só a montagem da mensagem
+        forwarder = offline_forwarder({'settings': {'template': template, 'trimming': False}})
+        route = forwarder.router.default_route
+        # Mesma saída quando o corpo cabe inteiro (ao cortar, o template
+        # compilado desconta também o texto fixo depois do corpo)
+        for record in records:
+            if len(record.body) < 3000:
+                assert forwarder.format_telegram_message(record, route) == \
+                    legacy_format_message(forwarder, record, template)
+        legacy = timeit(lambda: [legacy_format_message(forwarder, r, template) for r in records],
+                        repeat=3, number=3)
+        current = timeit(lambda: [forwarder.format_telegram_message(r, route) for r in records],
+                         repeat=3, number=3)
+        print(f"{label:17s} anterior {legacy / len(records):7.1f} µs/email   "
+              f"compilado {current / len(records):7.1f} µs/email")
+
+def benchmark_limits():
+    """Mensagens acima do limite do Telegram ou com escape cortado: anterior vs atual"""
+    print_header("Limite de tamanho (UTF-16) com emojis e pontuação")
+    rng = random.Random(41)
+    pieces = WORDS + ['😀', '👍🏽', '🇧🇷', '👨\u200d👩\u200d👧', 'v1.2', '(ok)', 'a_b', '-', '!'] * 3
+    records = []
+    for index in range(300):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': 'Equipe 🚀 <time@empresa.com>'},
+            {'name': 'Subject', 'value': f'Status {index} ✅ (v{index}.0)'},
+            {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        ])
+        record._body = ' '.join(rng.choice(pieces) for _ in range(rng.randint(200, 2000)))
+        record._attachments = []
+        records.append(record)
+
+    renderer = gtf.RENDERERS['MarkdownV2']
+    forwarder = offline_forwarder({'settings': {'trimming': False, 'max_message_length': 4096}})
+    for label, format_message in (("anterior", lambda r: legacy_format_message(forwarder, r)),
+                                  ("atual", forwarder.format_telegram_message)):
+        over = broken = 0
+        for record in records:
+            message = format_message(record)
+            errors, plain = gtf.scan_markdown(message)
+            broken += bool(errors)
+            over += gtf.utf16_length(plain) > gtf.TELEGRAM_MESSAGE_LIMIT
+        print(f"{label:9s} acima de {gtf.TELEGRAM_MESSAGE_LIMIT}: {over:4d}   "
+              f"marcação inválida: {broken:4d}   (de {len(records)})")
+
+def benchmark_split():
+    """Divisão de emails longos em várias mensagens"""
+    print_header("Divisão de emails longos")
+    rng = random.Random(43)
+    records = []
+    for index in range(200):
+        record = gtf.EmailRecord(f'msg{index}', [
+            {'name': 'From', 'value': 'Relatórios <relatorios@empresa.com>'},
+            {'name': 'Subject', 'value': f'Relatório semanal {index}'},
+            {'name': 'Date', 'value': 'Mon, 15 Jan 2024 14:30:00 +0000'},
+        ])
+        record._body = '\n\n'.join(random_text(rng, rng.randint(20, 200)) for _ in range(rng.randint(5, 60)))
+        record._attachments = []
+        records.append(record)
+
+    for max_parts in (1, 4, 10):
+        forwarder = offline_forwarder({'settings': {'trimming': False,
+                                                    'split_messages': {'enabled': True, 'max_parts': max_parts}}})
+        messages = [forwarder.format_telegram_messages(record) for record in records]
+        cost = timeit(lambda: [forwarder.format_telegram_messages(r) for r in records], repeat=3, number=1)
+        total = sum(len(parts) for parts in messages)
+        cut = sum(1 for parts in messages if '\\.\\.\\.' in parts[-1])
+        print(f"até {max_parts:2d} partes: {cost / len(records):7.1f} µs/email   "
+              f"{total / len(records):4.1f} mensagens/email   {cut:3d} ainda cortados")
+
+def legacy_email_data(message):
+    """Reproduz o dicionário montado pela versão anterior de get_email_details"""
+    headers = message['payload'].get('headers', [])
+
+    def header(name):
+        for item in headers:
+            if item['name'] == name:
+                return item['value']
+        return ''
+
+    def body(payload):
+        if 'parts' in payload:
+            return ''.join(body(part) for part in payload['parts'])
+        data = payload['body'].get('data', '')
+        if not data:
+            return ''
+        text = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+        return gtf.re.sub('<[^<]+?>', '', text) if payload['mimeType'] == 'text/html' else text
+
+    return {
+        'id': message['id'],
+        'subject': header('Subject'),
+        'from': header('From'),
+        'to': header('To'),
+        'date': header('Date'),
+        'body': body(message['payload']),
+        'attachments': gtf.extract_attachments_from_payload(message['payload']),
+    }
+
+def measure_memory(build, count):
+    """Mede a memória retida por ``count`` objetos criados por ``build``"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    items = [build(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return items, retained / count
+
+def benchmark_memoria():
+    """Memória por mensagem retida: dicionário antigo vs EmailRecord"""
+    print_header("Memória por mensagem retida (5000 mensagens)")
+    rng = random.Random(42)
+    messages = [sample_message(rng, i) for i in range(5000)]
+
+    _, legacy = measure_memory(lambda i: legacy_email_data(messages[i]), len(messages))
+
+    def build_record(i):
+        record = gtf.EmailRecord.from_message(messages[i])
+        # Simula o caminho completo: filtros, formatação e anexos
+        record.text
+        record.attachments
+        record.body
+        record.compact()
+        return record
+
+    _, compact = measure_memory(build_record, len(messages))
+
+    print(f"dict (versão anterior):  {legacy / 1024:8.2f} KiB/mensagem")
+    print(f"EmailRecord:             {compact / 1024:8.2f} KiB/mensagem "
+          f"({(1 - compact / legacy) * 100:.1f}% menor)")
+
+BENCHMARKS = {
+    'memoria': benchmark_memoria,
+    'trimming': benchmark_trimming,
+    'anexos': benchmark_attachments,
+    'offload': benchmark_offload,
+    'keywords': benchmark_keywords,
+    'padroes': benchmark_patterns,
+    'routing': benchmark_routing,
+    'senders': benchmark_senders,
+    'normalizacao': benchmark_normalization,
+    'duplicados': benchmark_duplicates,
+    'prioridade': benchmark_priority,
+    'escape': benchmark_escape,
+    'renderizacao': benchmark_render,
+    'validacao': benchmark_validation,
+    'templates': benchmark_templates,
+    'limite': benchmark_limits,
+    'divisao': benchmark_split,
+}
+
+def main():
+    """Função principal dos benchmarks"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ Benchmark desconhecido: {name}")
+            print(f"   Disponíveis: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
 import os
+import sys
 import json
 import time
 import base64
 import logging
+import threading
+import functools
+import hashlib
+import html
+from collections import OrderedDict, deque, namedtuple
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from email.header import decode_header, make_header
+from email.errors import HeaderParseError
 from email.mime.text import MIMEText
+from email.utils import parseaddr
 import pickle
 import re
+import string
+import unicodedata
+import zlib
 
 import requests
 from google.auth.transport.requests import Request
@@ -14,6 +28,12 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+# NumPy é opcional: acelera a pontuação de prioridade em lote
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,6 +44,2985 @@ logging.basicConfig(
     ]
 )
 
+@functools.lru_cache(maxsize=4096)
+def decode_header_value(value):
+    """Decodifica encoded-words RFC 2047 (ex.: =?UTF-8?B?...?=) com memoização"""
+    # Caminho rápido: a maioria dos cabeçalhos não tem encoded-words
+    if '=?' not in value:
+        return value
+    
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, UnicodeDecodeError, LookupError):
+        return value
+
+# Marcas combinantes (acentos) que sobram após a decomposição NFKD
+COMBINING_MARKS = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]')
+
+def normalize_text(text):
+    """Normaliza texto para comparação: casefold e remoção de acentos (NFKD)
+    
+    Textos só com ASCII (a maioria) seguem por um caminho rápido, sem
+    passar por ``unicodedata``.
+    """
+    if text.isascii():
+        return text.lower()
+    return COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text.casefold()))
+
+# Cabeçalhos de rastreamento volumosos descartados ao montar o registro (os
+# citados por regras de cabeçalho são mantidos, ver ``header_skip``)
+TRACE_HEADERS = frozenset([
+    'received', 'x-received', 'dkim-signature', 'x-google-dkim-signature',
+    'arc-seal', 'arc-message-signature', 'arc-authentication-results',
+    'authentication-results', 'received-spf', 'x-google-smtp-source',
+    'x-gm-message-state',
+])
+
+class HeaderIndex:
+    """Índice de cabeçalhos de uma mensagem, sem diferenciar maiúsculas/minúsculas
+    
+    O índice é construído uma única vez por mensagem e a decodificação RFC 2047
+    só acontece quando o valor é lido.
+    """
+    __slots__ = ('_headers',)
+    
+    def __init__(self, headers=None, skip=()):
+        index = {}
+        for header in headers or ():
+            name = sys.intern(header['name'].lower())
+            if name in skip:
+                continue
+            current = index.get(name)
+            if current is None:
+                index[name] = header['value']
+            elif isinstance(current, tuple):
+                index[name] = current + (header['value'],)
+            else:
+                index[name] = (current, header['value'])
+        self._headers = index
+    
+    def get(self, name, default=''):
+        """Retorna o primeiro valor decodificado do cabeçalho"""
+        value = self.get_raw(name, None)
+        if value is None:
+            return default
+        return decode_header_value(value)
+    
+    def get_raw(self, name, default=''):
+        """Retorna o primeiro valor do cabeçalho sem decodificar"""
+        value = self._headers.get(name.lower())
+        if value is None:
+            return default
+        return value[0] if isinstance(value, tuple) else value
+    
+    def get_all(self, name):
+        """Retorna todos os valores decodificados do cabeçalho"""
+        value = self._headers.get(name.lower())
+        if value is None:
+            return []
+        values = value if isinstance(value, tuple) else (value,)
+        return [decode_header_value(item) for item in values]
+    
+    def __contains__(self, name):
+        return name.lower() in self._headers
+    
+    def __len__(self):
+        return len(self._headers)
+
+def extract_body_from_payload(payload):
+    """Extrai corpo do email de forma recursiva"""
+    if 'parts' in payload:
+        if payload.get('mimeType') == 'multipart/alternative':
+            # Versões alternativas do mesmo conteúdo: usa só a primeira não vazia,
+            # preferindo texto simples, em vez de concatenar texto e HTML
+            parts = sorted(payload['parts'], key=lambda part: part.get('mimeType') != 'text/plain')
+            for part in parts:
+                body = extract_body_from_payload(part)
+                if body:
+                    return body
+            return ''
+        return ''.join([extract_body_from_payload(part) for part in payload['parts']])
+    
+    mime_type = payload.get('mimeType')
+    if mime_type not in ('text/plain', 'text/html'):
+        return ''
+    
+    data = payload.get('body', {}).get('data', '')
+    if not data:
+        return ''
+    
+    body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+    if mime_type == 'text/html':
+        # Remove tags HTML básicas
+        body = re.sub('<[^<]+?>', '', body)
+    return body
+
+def text_parts_size(payload):
+    """Tamanho (base64) das partes de texto que ``extract_body_from_payload`` decodifica
+    
+    Diferente de ``sizeEstimate``, não conta os anexos, que o parsing só
+    descreve pelos metadados.
+    """
+    if 'parts' in payload:
+        return sum(text_parts_size(part) for part in payload['parts'])
+    if payload.get('mimeType') not in ('text/plain', 'text/html'):
+        return 0
+    return len(payload.get('body', {}).get('data', ''))
+
+CID_REFERENCE = re.compile(r'cid:([^"\'\s>)]+)', re.IGNORECASE)
+
+class AttachmentRule:
+    """Regra de ``settings.attachment_rules`` avaliada só com os metadados do anexo
+    
+    Todas as condições informadas precisam casar; dentro de cada lista basta
+    um item. Tipos MIME aceitam curinga no subtipo (``image/*``) e nomes de
+    arquivo aceitam globs (``logo*``), sem diferenciar maiúsculas.
+    """
+    __slots__ = ('name', 'forward', 'mime_types', 'mime_prefixes', 'extensions',
+                 'filenames', 'min_size', 'max_size')
+    
+    ACTIONS = ('forward', 'skip')
+    KEYS = ('name', 'action', 'mime_types', 'extensions', 'filenames', 'min_size_kb', 'max_size_kb')
+    
+    def __init__(self, name, forward, mime_types=(), extensions=(), filenames=(), min_size=None, max_size=None):
+        self.name = name
+        self.forward = forward
+        mime_types = [mime_type.lower() for mime_type in mime_types]
+        self.mime_types = frozenset(mime_type for mime_type in mime_types if not mime_type.endswith('/*'))
+        self.mime_prefixes = tuple(mime_type[:-1] for mime_type in mime_types if mime_type.endswith('/*'))
+        self.extensions = frozenset('.' + extension.lower().lstrip('.') for extension in extensions)
+        # Conferido com fullmatch: cada glob descreve o nome inteiro
+        self.filenames = (re.compile('|'.join(f'(?:{glob_to_regex(pattern.lower())})' for pattern in filenames))
+                          if filenames else None)
+        self.min_size = min_size
+        self.max_size = max_size
+    
+    @classmethod
+    def compile(cls, index, rule):
+        """Valida e compila uma entrada de ``attachment_rules``"""
+        where = f"settings.attachment_rules[{index}]"
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where} deve ser um objeto")
+        unknown = [key for key in rule if key not in cls.KEYS]
+        if unknown:
+            raise ValueError(f"{where}: chaves desconhecidas: {', '.join(unknown)}")
+        
+        action = rule.get('action', 'skip')
+        if action not in cls.ACTIONS:
+            raise ValueError(f"{where}.action deve ser 'forward' ou 'skip'")
+        
+        lists = {}
+        for key in ('mime_types', 'extensions', 'filenames'):
+            items = rule.get(key, [])
+            if not isinstance(items, list) or not all(isinstance(item, str) and item for item in items):
+                raise ValueError(f"{where}.{key} deve ser uma lista de textos")
+            lists[key] = items
+        
+        sizes = {}
+        for key in ('min_size_kb', 'max_size_kb'):
+            value = rule.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"{where}.{key} deve ser um número não negativo")
+            sizes[key] = int(value * 1024) if value is not None else None
+        
+        if not any(lists.values()) and sizes['min_size_kb'] is None and sizes['max_size_kb'] is None:
+            raise ValueError(f"{where} precisa de pelo menos uma condição")
+        
+        name = str(rule.get('name', f"{action} {index + 1}"))
+        return cls(name, action == 'forward', min_size=sizes['min_size_kb'], max_size=sizes['max_size_kb'], **lists)
+    
+    def matches(self, attachment):
+        """Verifica se os metadados do anexo satisfazem todas as condições"""
+        if self.mime_types or self.mime_prefixes:
+            mime_type = attachment['mimeType'].lower()
+            if mime_type not in self.mime_types and not mime_type.startswith(self.mime_prefixes):
+                return False
+        filename = attachment['filename'].lower()
+        if self.extensions and os.path.splitext(filename)[1] not in self.extensions:
+            return False
+        if self.filenames is not None and not self.filenames.fullmatch(filename):
+            return False
+        size = attachment['size']
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return True
+
+class AttachmentOptions:
+    """Opções de extração de anexos (compartilhadas por todos os registros)"""
+    __slots__ = ('include_attachments', 'skip_inline_images', 'min_image_size', 'rules', 'forward_by_default')
+    
+    # Imagens embutidas a partir deste tamanho são fotos coladas no corpo, não logos
+    DEFAULT_MIN_IMAGE_SIZE_KB = 100
+    
+    def __init__(self, include_attachments=True, skip_inline_images=True,
+                 min_image_size=DEFAULT_MIN_IMAGE_SIZE_KB * 1024, rules=(), forward_by_default=True):
+        self.include_attachments = include_attachments
+        self.skip_inline_images = skip_inline_images
+        self.min_image_size = min_image_size
+        self.rules = tuple(rules)
+        self.forward_by_default = forward_by_default
+    
+    @classmethod
+    def from_settings(cls, settings):
+        """Cria as opções a partir da seção ``settings`` do config.json
+        
+        Raises:
+            ValueError: se ``attachment_rules``, ``attachment_default`` ou
+                ``min_image_size_kb`` forem inválidos
+        """
+        rules = settings.get('attachment_rules', [])
+        if not isinstance(rules, list):
+            raise ValueError("settings.attachment_rules deve ser uma lista")
+        default = settings.get('attachment_default', 'forward')
+        if default not in AttachmentRule.ACTIONS:
+            raise ValueError("settings.attachment_default deve ser 'forward' ou 'skip'")
+        min_image_size_kb = settings.get('min_image_size_kb', cls.DEFAULT_MIN_IMAGE_SIZE_KB)
+        if (isinstance(min_image_size_kb, bool) or not isinstance(min_image_size_kb, (int, float))
+                or min_image_size_kb < 0):
+            raise ValueError("settings.min_image_size_kb deve ser um número não negativo (0 = sem limite)")
+        
+        return cls(
+            include_attachments=settings.get('include_attachments', True),
+            skip_inline_images=settings.get('skip_inline_images', True),
+            min_image_size=int(min_image_size_kb * 1024),
+            rules=[AttachmentRule.compile(index, rule) for index, rule in enumerate(rules)],
+            forward_by_default=default == 'forward',
+        )
+    
+    def skip_reason(self, attachment):
+        """Motivo para não encaminhar o anexo (a primeira regra que casar decide)"""
+        for rule in self.rules:
+            if rule.matches(attachment):
+                return None if rule.forward else f"regra '{rule.name}'"
+        return None if self.forward_by_default else "nenhuma regra de encaminhamento"
+    
+    def is_embedded(self, attachment):
+        """Indica se o anexo é uma imagem embutida no HTML (logo, pixel, assinatura)
+        
+        Só conta como embutida a imagem referenciada por ``cid:`` no HTML;
+        ``Content-Disposition: inline`` sozinho não basta (Apple Mail e
+        clientes móveis marcam assim fotos anexadas).
+        """
+        if not self.skip_inline_images or not attachment['mimeType'].startswith('image/'):
+            return False
+        if not attachment['referenced']:
+            return False
+        # Imagens embutidas grandes (ex.: foto ou print colado no corpo) são consideradas reais
+        return not self.min_image_size or attachment['size'] < self.min_image_size
+
+def find_html_cid_references(payload):
+    """Retorna os Content-IDs referenciados por ``cid:`` nas partes HTML"""
+    references = set()
+    
+    def process(part):
+        if 'parts' in part:
+            for child in part['parts']:
+                process(child)
+        elif part.get('mimeType') == 'text/html':
+            data = part.get('body', {}).get('data', '')
+            if data:
+                markup = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+                references.update(cid.lower() for cid in CID_REFERENCE.findall(markup))
+    
+    process(payload)
+    return references
+
+def extract_attachments_from_payload(payload):
+    """Extrai informações sobre anexos de um payload do Gmail
+    
+    Cada anexo indica se foi marcado como ``inline`` e se seu Content-ID é
+    referenciado pelo HTML da mensagem.
+    """
+    attachments = []
+    has_content_id = False
+    
+    def process_parts(parts):
+        nonlocal has_content_id
+        for part in parts:
+            if part.get('filename'):
+                headers = HeaderIndex(part.get('headers', []))
+                content_id = headers.get_raw('Content-ID').strip().strip('<>').lower()
+                has_content_id = has_content_id or bool(content_id)
+                attachment = {
+                    'filename': part['filename'],
+                    'mimeType': part['mimeType'],
+                    'size': part['body'].get('size', 0),
+                    'attachmentId': part['body'].get('attachmentId'),
+                    'inline': headers.get_raw('Content-Disposition').lower().startswith('inline'),
+                    'contentId': content_id,
+                    'referenced': False
+                }
+                attachments.append(attachment)
+            
+            if 'parts' in part:
+                process_parts(part['parts'])
+    
+    if 'parts' in payload:
+        process_parts(payload['parts'])
+    
+    # Só decodifica o HTML se algum anexo tiver Content-ID
+    if has_content_id:
+        references = find_html_cid_references(payload)
+        for attachment in attachments:
+            attachment['referenced'] = attachment['contentId'] in references
+    
+    return attachments
+
+class EmailRecord:
+    """Registro compacto de um email compartilhado por filtros, formatador e envio
+    
+    Corpo, texto normalizado e anexos são calculados no primeiro acesso e
+    guardados. O payload bruto do Gmail é liberado assim que não é mais necessário.
+    """
+    __slots__ = ('id', 'headers', '_payload', '_options', '_pending', '_sender_address',
+                 '_body', '_text', '_body_start', '_attachments', '_inline_attachments',
+                 '_skipped_attachments', 'labels')
+    
+    # Compatibilidade com o antigo formato em dicionário (email_data['from'], ...)
+    _KEY_ALIASES = {'from': 'sender'}
+    
+    # Opções padrão quando o registro é criado sem configuração
+    DEFAULT_OPTIONS = AttachmentOptions()
+    
+    def __init__(self, message_id, headers, payload=None, options=None, labels=(),
+                 header_skip=TRACE_HEADERS):
+        self.id = message_id
+        if not isinstance(headers, HeaderIndex):
+            headers = HeaderIndex(headers, skip=header_skip)
+        self.headers = headers
+        self._payload = payload
+        self._options = options or self.DEFAULT_OPTIONS
+        self._pending = None
+        self._sender_address = None
+        self._body = None
+        self._text = None
+        self._body_start = 0
+        self._attachments = None
+        self._inline_attachments = None
+        self._skipped_attachments = None
+        self.labels = tuple(sys.intern(label) for label in labels)
+    
+    @classmethod
+    def from_message(cls, message, options=None, header_skip=TRACE_HEADERS):
+        """Cria o registro a partir de uma mensagem da Gmail API"""
+        payload = message['payload']
+        return cls(message['id'], payload.get('headers', []), payload, options,
+                   message.get('labelIds') or (), header_skip)
+    
+    @property
+    def subject(self):
+        return self.headers.get('Subject')
+    
+    @property
+    def sender(self):
+        return self.headers.get('From')
+    
+    @property
+    def sender_address(self):
+        """Endereço do remetente, sem nome de exibição e em minúsculas"""
+        if self._sender_address is None:
+            self._sender_address = normalize_text(parseaddr(self.sender)[1])
+        return self._sender_address
+    
+    @property
+    def to(self):
+        return self.headers.get('To')
+    
+    @property
+    def date(self):
+        return self.headers.get('Date')
+    
+    @property
+    def body(self):
+        """Corpo decodificado (calculado no primeiro acesso)"""
+        if self._pending is not None:
+            self._resolve()
+        if self._body is None:
+            self._body = extract_body_from_payload(self._payload) if self._payload else ''
+            self._release_payload()
+        return self._body
+    
+    @property
+    def text(self):
+        """Assunto, remetente e corpo normalizados para comparação
+        
+        O corpo fica no final do texto, a partir de ``body_start``; assim
+        filtros só do corpo usam ``text.find(palavra, body_start)`` sem
+        manter uma segunda cópia normalizada do corpo.
+        """
+        if self._text is None:
+            prefix = f"{normalize_text(self.subject)} {normalize_text(self.sender)} "
+            self._text = prefix + normalize_text(self.body)
+            self._body_start = len(prefix)
+        return self._text
+    
+    @property
+    def body_start(self):
+        """Posição onde o corpo começa em ``text``"""
+        if self._text is None:
+            self.text
+        return self._body_start
+    
+    @property
+    def body_text(self):
+        """Corpo normalizado (fatia de ``text``)"""
+        return self.text[self.body_start:]
+    
+    @property
+    def attachments(self):
+        """Lista de anexos a encaminhar (calculada no primeiro acesso)"""
+        if self._pending is not None:
+            self._resolve()
+        if self._attachments is None:
+            self._classify_attachments()
+        return self._attachments
+    
+    @property
+    def inline_attachments(self):
+        """Imagens embutidas no HTML, que não são encaminhadas"""
+        if self._pending is not None:
+            self._resolve()
+        if self._inline_attachments is None:
+            self._classify_attachments()
+        return self._inline_attachments
+    
+    @property
+    def skipped_attachments(self):
+        """Anexos recusados por ``attachment_rules`` (com o motivo em ``skipReason``)"""
+        if self._pending is not None:
+            self._resolve()
+        if self._skipped_attachments is None:
+            self._classify_attachments()
+        return self._skipped_attachments
+    
+    def _classify_attachments(self):
+        """Separa anexos reais das imagens embutidas no HTML e dos recusados pelas regras"""
+        attachments = []
+        inline_attachments = []
+        skipped_attachments = []
+        options = self._options
+        if options.include_attachments and self._payload:
+            for attachment in extract_attachments_from_payload(self._payload):
+                if options.is_embedded(attachment):
+                    inline_attachments.append(attachment)
+                    continue
+                reason = options.skip_reason(attachment)
+                if reason is not None:
+                    attachment['skipReason'] = reason
+                    skipped_attachments.append(attachment)
+                else:
+                    attachments.append(attachment)
+        self._attachments = attachments
+        self._inline_attachments = inline_attachments
+        self._skipped_attachments = skipped_attachments
+        self._release_payload()
+    
+    @property
+    def parsed(self):
+        """Indica se corpo e anexos podem ser lidos sem esperar o pool de parsing"""
+        return self._pending is None or self._pending.done()
+    
+    def defer(self, future):
+        """Associa o parsing feito em outro processo (ver ``parse_message``)
+        
+        O payload local é descartado: a cópia enviada ao pool é a única
+        mantida até o resultado chegar.
+        """
+        self._pending = future
+        self._payload = None
+    
+    def resolve(self):
+        """Aguarda o parsing em outro processo e adota o resultado
+        
+        Returns:
+            bool: False se o parsing no pool falhou. O payload já foi
+            descartado, então o email precisa ser baixado e processado de novo
+            (ver ``GmailTelegramForwarder.iter_email_details``).
+        """
+        future, self._pending = self._pending, None
+        if future is None:
+            return True
+        try:
+            parsed = future.result()
+        except Exception as e:
+            logging.warning(f"Falha no parsing do email {self.id} em processo separado: {e}")
+            return False
+        
+        self._body = parsed._body
+        self._attachments = parsed._attachments
+        self._inline_attachments = parsed._inline_attachments
+        self._skipped_attachments = parsed._skipped_attachments
+        self._payload = None
+        return True
+    
+    def _resolve(self):
+        # Nunca segue com corpo vazio: um email sem conteúdo seria encaminhado
+        if not self.resolve():
+            raise RuntimeError(f"Parsing do email {self.id} falhou e o payload foi descartado")
+    
+    def compact(self):
+        """Descarta o texto normalizado (recalculável) para reduzir a memória retida"""
+        self._text = None
+        self._body_start = 0
+    
+    def _release_payload(self):
+        """Libera o payload bruto quando corpo e anexos já foram extraídos"""
+        if self._body is not None and self._attachments is not None:
+            self._payload = None
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._KEY_ALIASES.get(key, key))
+        except AttributeError:
+            raise KeyError(key) from None
+
+class KeywordAutomaton:
+    """Autômato Aho-Corasick para procurar várias palavras-chave em uma passada
+    
+    As palavras-chave são compiladas uma única vez (ao carregar a configuração)
+    em um autômato determinístico. Cada texto é percorrido caractere a caractere
+    uma única vez, qualquer que seja o número de palavras-chave.
+    
+    Para listas pequenas, ``str.find`` (em C) é mais rápido que o laço em
+    Python do autômato; abaixo de ``AUTOMATON_MIN_KEYWORDS`` ele é usado.
+    """
+    __slots__ = ('keywords', '_delta', '_output')
+    
+    # Ponto de equilíbrio medido com corpos de ~5 mil caracteres
+    AUTOMATON_MIN_KEYWORDS = 64
+    
+    def __init__(self, keywords):
+        # Normaliza e remove duplicadas mantendo a ordem da configuração
+        normalized = []
+        for keyword in keywords:
+            keyword = normalize_text(keyword)
+            if keyword and keyword not in normalized:
+                normalized.append(keyword)
+        self.keywords = tuple(normalized)
+        self._delta = None
+        self._output = None
+        
+        if len(self.keywords) < self.AUTOMATON_MIN_KEYWORDS:
+            return
+        
+        # Trie das palavras-chave
+        goto = [{}]
+        output = [()]
+        for keyword in self.keywords:
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    output.append(())
+                    goto[state][char] = next_state
+                state = next_state
+            output[state] = (keyword,)
+        
+        # Links de falha em largura, já convertidos em transições diretas
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions = dict(delta[fail[state]])
+            for char, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(char, 0) if state else 0
+                transitions[char] = next_state
+                queue.append(next_state)
+            delta[state] = transitions
+            if output[fail[state]]:
+                output[state] = output[state] + output[fail[state]]
+        
+        self._delta = delta
+        self._output = [outputs or None for outputs in output]
+    
+    def __bool__(self):
+        return bool(self.keywords)
+    
+    def __len__(self):
+        return len(self.keywords)
+    
+    def search(self, text, start=0):
+        """Retorna a primeira palavra-chave encontrada em ``text[start:]`` (ou None)"""
+        if not self.keywords:
+            return None
+        
+        if self._delta is None:
+            for keyword in self.keywords:
+                if text.find(keyword, start) != -1:
+                    return keyword
+            return None
+        
+        delta = self._delta
+        output = self._output
+        state = 0
+        for char in islice(text, start, None):
+            state = delta[state].get(char, 0)
+            if output[state] is not None:
+                return output[state][0]
+        return None
+    
+    def find_all(self, text, start=0):
+        """Retorna todas as palavras-chave encontradas em ``text[start:]``"""
+        if self._delta is None:
+            return [keyword for keyword in self.keywords if text.find(keyword, start) != -1]
+        
+        found = {}
+        delta = self._delta
+        output = self._output
+        state = 0
+        for char in islice(text, start, None):
+            state = delta[state].get(char, 0)
+            if output[state] is not None:
+                for keyword in output[state]:
+                    found[keyword] = True
+        return list(found)
+
+def glob_to_regex(pattern):
+    """Converte um glob simples (``*`` e ``?``) em expressão regular"""
+    parts = []
+    for char in pattern:
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+class PatternMatcher:
+    """Padrões regex ou glob de um mesmo tipo compilados em uma única alternação
+    
+    Cada padrão vira um grupo nomeado, então uma única varredura avalia todos
+    os padrões do grupo e ``lastgroup`` indica qual regra casou. Os textos
+    varridos são normalizados (sem acentos, em minúsculas), então os
+    caracteres literais dos padrões passam pela mesma normalização.
+    
+    Proteções contra backtracking catastrófico:
+    - padrões com quantificadores aninhados (ex.: ``(a+)+``), alternâncias
+      ambíguas sob repetição (ex.: ``(a|aa)+``) ou retrorreferências são
+      rejeitados na compilação;
+    - o texto varrido é limitado a ``max_scan_chars`` caracteres;
+    - varreduras acima de ``slow_ms`` geram um aviso e, após
+      ``MAX_SLOW_SCANS`` ocorrências, o grupo é desativado. Não é um limite:
+      a duração só é conhecida ao fim da varredura, que não é interrompida.
+    """
+    
+    FIELDS = ('text', 'subject', 'from', 'body')
+    MAX_PATTERN_LENGTH = 500
+    MAX_SLOW_SCANS = 3
+    
+    # Quantificador que repete mais de uma vez: *, +, {2}, {2,5}, {2,} ({1} e {0} não)
+    REPETITION = r'(?:[*+]|\{(?!0*1?\})\d*(?:,\d*)?\})'
+    
+    # Grupo quantificado que contém outro quantificador: (a+)+, (\w*)*, (a|b+){2,}, (.*,){6}
+    NESTED_QUANTIFIER = re.compile(r'\((?:[^()\\]|\\.)*[*+}](?:[^()\\]|\\.)*\)' + REPETITION)
+    BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+    
+    # Grupo sem subgrupos seguido de repetição: (a|aa)+, (?:x|y){2,}
+    INNERMOST_GROUP = re.compile(r'\(((?:[^()\\]|\\.)*)\)(' + REPETITION + ')?')
+    GROUP_PREFIX = re.compile(r'\?(?:[:=!]|<[=!]|P<\w+>|[aiLmsux-]+:)')
+    REGEX_METACHARS = frozenset('.^$*+?{}[]|()')
+    
+    # Flags globais embutidas: (?i), (?s)...
+    GLOBAL_FLAGS = re.compile(r'(?<!\\)\(\?([aiLmsux]+)\)')
+    
+    def __init__(self, kind, field, rules, max_scan_chars=100000, slow_ms=50):
+        self.kind = kind
+        self.field = field
+        self.names = {}
+        self.max_scan_chars = max_scan_chars
+        self.slow_seconds = slow_ms / 1000
+        self.slow_scans = 0
+        self.enabled = True
+        self.warnings = []
+        self.sources = []
+        self.separate = None
+        
+        groups = []
+        offsets = []
+        for index, (name, pattern) in enumerate(rules):
+            self.check_complexity(name, pattern)
+            if kind == 'glob':
+                # "*" atravessa quebras de linha: o glob descreve o campo inteiro
+                source = f'(?s:{glob_to_regex(normalize_text(pattern))})'
+            else:
+                source = self.normalize_source(name, self.scope_global_flags(name, pattern))
+            try:
+                re.compile(source)
+            except re.error as e:
+                raise ValueError(f"Padrão '{name}' inválido: {e}") from None
+            group = f'p{index}'
+            self.names[group] = name
+            self.sources.append((name, source))
+            offsets.append(sum(len(item) + 1 for item in groups))
+            groups.append(f'(?P<{group}>{source})')
+        
+        try:
+            self.pattern = re.compile('|'.join(groups), re.MULTILINE)
+        except re.error as e:
+            # Aponta a regra cujo trecho contém a posição do erro
+            position = e.pos or 0
+            culprit = max(index for index, offset in enumerate(offsets) if offset <= position)
+            raise ValueError(f"Padrão '{rules[culprit][0]}' não pode ser combinado com os demais: {e.msg}") from None
+    
+    def normalize_source(self, name, pattern):
+        """Aplica ``normalize_text`` aos caracteres literais da regex
+        
+        "Notificação" vira "notificacao" e "straße" vira "strasse", como no
+        texto varrido, que já está em minúsculas: assim a regex dispensa
+        ``re.IGNORECASE`` (bem mais lento). Escapes (``\\W``, ``\\N{...}``) e
+        a sintaxe ``(?P<nome>`` não mudam; maiúsculas escritas como escape
+        (``\\x41``) não casam. Dentro de ``[...]`` um caractere que vira mais
+        de um (ex.: "ß") não pode ser representado e gera um aviso de que
+        nunca casa.
+        """
+        parts = []
+        in_class = False
+        index = 0
+        while index < len(pattern):
+            char = pattern[index]
+            if pattern.startswith('(?P', index):
+                parts.append('(?P')
+                index += 3
+                continue
+            if pattern.startswith('\\N{', index):
+                end = pattern.find('}', index) + 1 or len(pattern)
+                parts.append(pattern[index:end])
+                index = end
+                continue
+            if char == '\\':
+                escaped = pattern[index + 1:index + 2]
+                if escaped and not escaped.isascii():
+                    # "\ç" é só o literal "ç"
+                    index += 1
+                    continue
+                parts.append(pattern[index:index + 2])
+                index += 2
+                continue
+            index += 1
+            if char == '[':
+                in_class = True
+            elif char == ']':
+                in_class = False
+            if char.isascii():
+                parts.append(char.lower())
+                continue
+            
+            normalized = normalize_text(char)
+            if len(normalized) <= 1:
+                parts.append(normalized)
+            elif not in_class:
+                parts.append(f'(?:{re.escape(normalized)})')
+            else:
+                parts.append(char)
+                self.warnings.append(f"Padrão '{name}': '{char}' dentro de [...] nunca casa "
+                                     f"(o texto é comparado como '{normalized}')")
+        return ''.join(parts)
+    
+    @classmethod
+    def scope_global_flags(cls, name, pattern):
+        """Converte flags globais do início do padrão (``(?i)``) em flags de grupo
+        
+        Cada padrão vira um grupo da alternação combinada, onde flags globais
+        não são aceitas; ``(?s)abc`` passa a ``(?s:abc)`` e vale só para o
+        próprio padrão. Flags globais fora do início são rejeitadas.
+        """
+        match = cls.GLOBAL_FLAGS.match(pattern)
+        if match:
+            pattern = f'(?{match.group(1)}:{pattern[match.end():]})'
+        if cls.GLOBAL_FLAGS.search(pattern):
+            raise ValueError(f"Padrão '{name}': flags como (?i) só são aceitas no início; use (?i:...)")
+        return pattern
+    
+    @classmethod
+    def check_complexity(cls, name, pattern):
+        """Rejeita padrões sujeitos a backtracking catastrófico"""
+        if len(pattern) > cls.MAX_PATTERN_LENGTH:
+            raise ValueError(f"Padrão '{name}' excede {cls.MAX_PATTERN_LENGTH} caracteres")
+        if cls.NESTED_QUANTIFIER.search(pattern):
+            raise ValueError(f"Padrão '{name}' tem quantificadores aninhados (risco de backtracking)")
+        if cls.BACKREFERENCE.search(pattern):
+            raise ValueError(f"Padrão '{name}' usa retrorreferência (não suportado)")
+        if cls.has_ambiguous_repetition(pattern):
+            raise ValueError(f"Padrão '{name}' repete uma alternância ambígua (risco de backtracking); "
+                             f"use alternativas literais que comecem por caracteres diferentes")
+    
+    @classmethod
+    def has_ambiguous_repetition(cls, pattern):
+        """Indica se algum grupo repetido tem alternativas que podem casar o mesmo texto
+        
+        Em ``(a|aa)+`` o mesmo texto pode ser dividido de inúmeras formas
+        entre as alternativas, e a busca testa todas antes de falhar. Só são
+        aceitas alternativas literais que começam por caracteres distintos;
+        os grupos são avaliados de dentro para fora.
+        """
+        while True:
+            found = False
+            for match in cls.INNERMOST_GROUP.finditer(pattern):
+                found = True
+                if match.group(2) is None:
+                    continue
+                body = match.group(1)
+                if body.startswith('?'):
+                    body = cls.GROUP_PREFIX.sub('', body, count=1)
+                alternatives = cls.split_alternatives(body)
+                if len(alternatives) < 2:
+                    continue
+                if not all(alternative and cls.is_literal(alternative) for alternative in alternatives):
+                    return True
+                first = [alternative[:2] if alternative[0] == '\\' else alternative[0].casefold()
+                         for alternative in alternatives]
+                if len(set(first)) != len(first):
+                    return True
+            if not found:
+                return False
+            # Grupos internos viram um curinga: alternâncias externas repetidas
+            # que os contêm deixam de ser literais e são rejeitadas
+            pattern = cls.INNERMOST_GROUP.sub(lambda match: '.' + (match.group(2) or ''), pattern)
+    
+    @staticmethod
+    def split_alternatives(body):
+        """Divide o conteúdo de um grupo nas alternativas de nível superior"""
+        alternatives = []
+        current = []
+        in_class = False
+        index = 0
+        while index < len(body):
+            char = body[index]
+            if char == '\\':
+                current.append(body[index:index + 2])
+                index += 2
+                continue
+            if char == '[':
+                in_class = True
+            elif char == ']':
+                in_class = False
+            elif char == '|' and not in_class:
+                alternatives.append(''.join(current))
+                current = []
+                index += 1
+                continue
+            current.append(char)
+            index += 1
+        alternatives.append(''.join(current))
+        return alternatives
+    
+    @classmethod
+    def is_literal(cls, text):
+        """Indica se o trecho de regex só casa um texto fixo"""
+        index = 0
+        while index < len(text):
+            char = text[index]
+            if char == '\\':
+                escaped = text[index + 1:index + 2]
+                if not escaped or escaped.isalnum():
+                    return False
+                index += 2
+                continue
+            if char in cls.REGEX_METACHARS:
+                return False
+            index += 1
+        return True
+    
+    def field_value(self, record):
+        """Retorna o texto do registro varrido por este grupo e a posição inicial"""
+        if self.field == 'subject':
+            return normalize_text(record.subject), 0
+        if self.field == 'from':
+            return record.sender_address, 0
+        if self.field == 'body':
+            return record.text, record.body_start
+        return record.text, 0
+    
+    def match(self, record):
+        """Retorna o nome da regra que casou com o registro (ou None)"""
+        if not self.enabled:
+            return None
+        
+        text, start = self.field_value(record)
+        end = min(len(text), start + self.max_scan_chars)
+        
+        began = time.perf_counter()
+        if self.kind == 'glob':
+            # Globs descrevem o valor inteiro (ex.: *@*.gov.br)
+            match = self.pattern.fullmatch(text, start, end)
+        else:
+            match = self.pattern.search(text, start, end)
+        elapsed = time.perf_counter() - began
+        
+        if elapsed > self.slow_seconds:
+            self.slow_scans += 1
+            logging.warning(f"Padrões {self.kind} em '{self.field}' levaram {elapsed * 1000:.0f} ms "
+                            f"({self.slow_scans}/{self.MAX_SLOW_SCANS})")
+            if self.slow_scans >= self.MAX_SLOW_SCANS:
+                self.enabled = False
+                logging.error(f"Padrões {self.kind} em '{self.field}' desativados por lentidão: "
+                              f"{', '.join(self.names.values())}")
+        
+        return self.names[match.lastgroup] if match else None
+    
+    def find_all(self, record):
+        """Retorna os nomes de todas as regras do grupo que casam com o registro
+        
+        Usado em relatórios (ex.: replay): cada padrão é compilado e varrido
+        separadamente, então mais lento que ``match``.
+        """
+        if self.separate is None:
+            self.separate = [(name, re.compile(source, re.MULTILINE))
+                             for name, source in self.sources]
+        
+        text, start = self.field_value(record)
+        end = min(len(text), start + self.max_scan_chars)
+        if self.kind == 'glob':
+            return [name for name, pattern in self.separate if pattern.fullmatch(text, start, end)]
+        return [name for name, pattern in self.separate if pattern.search(text, start, end)]
+    
+    @classmethod
+    def compile_rules(cls, rules, max_scan_chars=100000, slow_ms=50):
+        """Agrupa as regras de ``filters.patterns`` por ação, tipo e campo
+        
+        Returns:
+            dict: {'include': [PatternMatcher, ...], 'exclude': [...]}
+        """
+        if not isinstance(rules, list):
+            raise ValueError("filters.patterns deve ser uma lista")
+        
+        grouped = {}
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise ValueError(f"filters.patterns[{index}] deve ser um objeto")
+            
+            kinds = [kind for kind in ('regex', 'glob') if kind in rule]
+            if len(kinds) != 1 or not isinstance(rule[kinds[0]], str) or not rule[kinds[0]]:
+                raise ValueError(f"filters.patterns[{index}] deve ter 'regex' ou 'glob'")
+            kind = kinds[0]
+            
+            name = str(rule.get('name', rule[kind]))
+            field = rule.get('field', 'from' if kind == 'glob' else 'text')
+            action = rule.get('action', 'include')
+            if field not in cls.FIELDS:
+                raise ValueError(f"Padrão '{name}': campo '{field}' inválido (use {', '.join(cls.FIELDS)})")
+            if action not in ('include', 'exclude'):
+                raise ValueError(f"Padrão '{name}': ação '{action}' inválida (use include ou exclude)")
+            
+            grouped.setdefault((action, kind, field), []).append((name, rule[kind]))
+        
+        matchers = {'include': [], 'exclude': []}
+        for (action, kind, field), group_rules in grouped.items():
+            matchers[action].append(cls(kind, field, group_rules, max_scan_chars, slow_ms))
+        return matchers
+
+class HeaderPredicate:
+    """Condição sobre um cabeçalho (List-Id, Precedence, X-Priority, Auto-Submitted...)
+    
+    Sem ``equals``, ``prefix`` ou ``contains`` basta o cabeçalho existir
+    (ou não existir, com ``"present": false``). Com eles, algum valor do
+    cabeçalho precisa casar com algum dos itens; a comparação ignora
+    maiúsculas e espaços nas pontas. Só lê cabeçalhos, então pode ser
+    avaliada antes de o corpo ser baixado.
+    """
+    __slots__ = ('name', 'header', 'present', 'equals', 'prefixes', 'contains')
+    
+    KEYS = ('name', 'header', 'present', 'equals', 'prefix', 'contains')
+    
+    def __init__(self, name, header, present=True, equals=(), prefixes=(), contains=()):
+        self.name = name
+        self.header = header
+        self.present = present
+        self.equals = frozenset(value.strip().lower() for value in equals)
+        self.prefixes = tuple(value.strip().lower() for value in prefixes)
+        self.contains = tuple(value.strip().lower() for value in contains)
+    
+    @classmethod
+    def compile(cls, where, rule, extra_keys=()):
+        """Valida e compila uma condição de cabeçalho"""
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where} deve ser um objeto")
+        unknown = [key for key in rule if key not in cls.KEYS + tuple(extra_keys)]
+        if unknown:
+            raise ValueError(f"{where}: chaves desconhecidas: {', '.join(unknown)}")
+        
+        header = rule.get('header')
+        if not isinstance(header, str) or not header.strip():
+            raise ValueError(f"{where}.header deve ser o nome de um cabeçalho")
+        header = header.strip()
+        
+        values = {}
+        for key in ('equals', 'prefix', 'contains'):
+            items = rule.get(key, [])
+            if isinstance(items, str):
+                items = [items]
+            if not isinstance(items, list) or not all(isinstance(item, str) and item.strip() for item in items):
+                raise ValueError(f"{where}.{key} deve ser um texto ou uma lista de textos")
+            values[key] = items
+        
+        present = rule.get('present', True)
+        if not isinstance(present, bool):
+            raise ValueError(f"{where}.present deve ser true ou false")
+        if not present and any(values.values()):
+            raise ValueError(f"{where}: 'present: false' não pode ser combinado com valores")
+        
+        if values['equals'] or values['prefix'] or values['contains']:
+            description = ' / '.join(values['equals'] + [f"{item}*" for item in values['prefix']] +
+                                     [f"*{item}*" for item in values['contains']])
+            default_name = f"{header}: {description}"
+        else:
+            default_name = header if present else f"sem {header}"
+        
+        return cls(str(rule.get('name', default_name)), header, present,
+                   values['equals'], values['prefix'], values['contains'])
+    
+    @classmethod
+    def compile_rules(cls, rules):
+        """Agrupa as regras de ``filters.headers`` por ação
+        
+        Returns:
+            dict: {'include': [HeaderPredicate, ...], 'exclude': [...]}
+        """
+        if not isinstance(rules, list):
+            raise ValueError("filters.headers deve ser uma lista")
+        
+        predicates = {'include': [], 'exclude': []}
+        for index, rule in enumerate(rules):
+            where = f"filters.headers[{index}]"
+            predicate = cls.compile(where, rule, extra_keys=('action',))
+            action = rule.get('action', 'exclude')
+            if action not in predicates:
+                raise ValueError(f"{where}: ação '{action}' inválida (use include ou exclude)")
+            predicates[action].append(predicate)
+        return predicates
+    
+    def matches(self, record):
+        """Verifica a condição nos cabeçalhos do registro"""
+        values = record.headers.get_all(self.header)
+        if not values:
+            return not self.present
+        if not self.present:
+            return False
+        if not (self.equals or self.prefixes or self.contains):
+            return True
+        
+        for value in values:
+            value = value.strip().lower()
+            if value in self.equals or (self.prefixes and value.startswith(self.prefixes)):
+                return True
+            if any(item in value for item in self.contains):
+                return True
+        return False
+
+class FilterCheck:
+    """Verificação de filtro com estatísticas de custo e seletividade
+    
+    ``needs_text`` indica que a verificação usa o texto normalizado; ele é
+    preparado fora da medição para que o custo de decodificar o corpo não
+    seja atribuído à primeira verificação que o usa. Como esse custo fica de
+    fora, as verificações de texto nunca são ordenadas antes das de
+    cabeçalho (ver ``CheckSchedule``).
+    """
+    __slots__ = ('name', 'function', 'needs_text', 'calls', 'rejects', 'elapsed')
+    
+    def __init__(self, name, function, needs_text=True):
+        self.name = name
+        self.function = function
+        self.needs_text = needs_text
+        self.calls = 0
+        self.rejects = 0
+        self.elapsed = 0.0
+    
+    def run(self, record):
+        """Executa a verificação; retorna o motivo da rejeição ou None"""
+        began = time.perf_counter()
+        reason = self.function(record)
+        self.elapsed += time.perf_counter() - began
+        self.calls += 1
+        if reason is not None:
+            self.rejects += 1
+        return reason
+    
+    def priority(self):
+        """Custo esperado por rejeição (menor roda primeiro)
+        
+        Usa suavização de Laplace para verificações ainda pouco executadas.
+        """
+        average_cost = self.elapsed / self.calls if self.calls else 0.0
+        reject_rate = (self.rejects + 1) / (self.calls + 2)
+        return average_cost / reject_rate
+    
+    def statistics(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'rejects': self.rejects,
+            'reject_rate': self.rejects / self.calls if self.calls else 0.0,
+            'average_us': self.elapsed / self.calls * 1e6 if self.calls else 0.0,
+        }
+
+class CheckSchedule:
+    """Ordem de execução e estatísticas das verificações de um ``FilterSet``
+    
+    É o estado de tempo de execução dos filtros, separado das regras
+    compiladas: muda a cada avaliação e as verificações são reordenadas a
+    cada ``REORDER_INTERVAL`` avaliações. As que usam só cabeçalhos rodam
+    sempre antes das que precisam do texto, cujo preparo (decodificar o
+    corpo) não entra na medição e só é feito se elas passarem.
+    """
+    __slots__ = ('checks', 'evaluations')
+    
+    # Avaliações entre reordenações das verificações
+    REORDER_INTERVAL = 50
+    
+    def __init__(self, checks):
+        self.checks = list(checks)
+        self.evaluations = 0
+    
+    def record_evaluation(self):
+        """Conta uma avaliação e reordena as verificações periodicamente"""
+        self.evaluations += 1
+        if self.evaluations % self.REORDER_INTERVAL == 0 and len(self.checks) > 1:
+            self.checks.sort(key=lambda check: (check.needs_text, check.priority()))
+    
+    def statistics(self):
+        """Estatísticas de custo e seletividade de cada verificação, na ordem atual"""
+        return [check.statistics() for check in self.checks]
+
+FilterDecision = namedtuple('FilterDecision', ['forward', 'reason'])
+Delivery = namedtuple('Delivery', ['action', 'reason', 'route', 'fingerprint'], defaults=(None,))
+
+class FilterSet:
+    """Filtros da seção ``filters`` compilados uma única vez
+    
+    Palavras-chave são normalizadas e compiladas em autômatos na criação; a
+    avaliação usa apenas o texto normalizado já guardado no ``EmailRecord``.
+    As regras são imutáveis; a ordem e as estatísticas das verificações, que
+    mudam a cada avaliação, ficam no ``CheckSchedule`` em ``schedule``.
+    """
+    __slots__ = ('from_addresses', 'senders', 'subject_keywords', 'exclude_keywords',
+                 'body_keywords', 'include_patterns', 'exclude_patterns',
+                 'include_headers', 'exclude_headers', 'max_query_senders', 'query_labels', 'sender_clause', 'max_age_hours', 'warnings',
+                 'schedule')
+    
+    LIST_KEYS = ('from_addresses', 'subject_keywords', 'body_keywords', 'exclude_keywords')
+    KNOWN_KEYS = LIST_KEYS + ('patterns', 'headers', 'pattern_max_scan_chars', 'pattern_slow_ms',
+                              'pattern_timeout_ms', 'max_query_senders', 'query_labels', 'max_age_hours')
+    
+    def __init__(self, from_addresses=(), subject_keywords=(), exclude_keywords=(),
+                 body_keywords=(), include_patterns=(), exclude_patterns=(),
+                 include_headers=(), exclude_headers=(), max_query_senders=50, query_labels=(), max_age_hours=24, warnings=()):
+        set_attribute = super().__setattr__
+        set_attribute('from_addresses', tuple(from_addresses))
+        set_attribute('senders', SenderIndex(from_addresses))
+        set_attribute('max_query_senders', max_query_senders)
+        set_attribute('query_labels', tuple(query_labels))
+        set_attribute('sender_clause', self.senders.gmail_query(
+            max_terms=max_query_senders, labels=query_labels) if self.senders else '')
+        set_attribute('subject_keywords', tuple(subject_keywords))
+        set_attribute('exclude_keywords', KeywordAutomaton(exclude_keywords))
+        set_attribute('body_keywords', KeywordAutomaton(body_keywords))
+        set_attribute('include_patterns', tuple(include_patterns))
+        set_attribute('exclude_patterns', tuple(exclude_patterns))
+        set_attribute('include_headers', tuple(include_headers))
+        set_attribute('exclude_headers', tuple(exclude_headers))
+        set_attribute('max_age_hours', max_age_hours)
+        set_attribute('warnings', tuple(warnings))
+        
+        # Ordem e estatísticas mudam em tempo de execução; as regras não
+        set_attribute('schedule', CheckSchedule(self.build_checks()))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("FilterSet é imutável; compile uma nova configuração")
+    
+    @property
+    def header_names(self):
+        """Cabeçalhos lidos pelas regras de ``filters.headers`` (minúsculas)"""
+        return frozenset(predicate.header.lower()
+                         for predicate in self.include_headers + self.exclude_headers)
+    
+    @property
+    def metadata_phase(self):
+        """Indica se há regras de cabeçalho que justificam baixar só os metadados primeiro"""
+        return bool(self.include_headers or self.exclude_headers)
+    
+    @classmethod
+    def compile(cls, filters):
+        """Valida e compila a seção ``filters`` do config.json
+        
+        Raises:
+            ValueError: se a configuração for inválida
+        """
+        if not isinstance(filters, dict):
+            raise ValueError("A seção 'filters' deve ser um objeto JSON")
+        
+        warnings = []
+        for key in filters:
+            if key not in cls.KNOWN_KEYS:
+                warnings.append(f"filters.{key} não é reconhecido e será ignorado")
+        
+        values = {}
+        for key in cls.LIST_KEYS:
+            items = filters.get(key, [])
+            if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+                raise ValueError(f"filters.{key} deve ser uma lista de textos")
+            
+            cleaned = []
+            for item in items:
+                item = item.strip()
+                if not item:
+                    warnings.append(f"filters.{key} contém um valor vazio, ignorado")
+                elif normalize_text(item) in (normalize_text(value) for value in cleaned):
+                    warnings.append(f"filters.{key} contém '{item}' repetido")
+                else:
+                    cleaned.append(item)
+            values[key] = cleaned
+        
+        max_age_hours = filters.get('max_age_hours', 24)
+        if isinstance(max_age_hours, bool) or not isinstance(max_age_hours, (int, float)) or max_age_hours <= 0:
+            raise ValueError("filters.max_age_hours deve ser um número positivo")
+        
+        # Regras que nunca encaminham: todo email que as satisfaz contém uma
+        # palavra de exclusão (o texto comparado inclui assunto, corpo e remetente)
+        exclude = [normalize_text(keyword) for keyword in values['exclude_keywords']]
+        for key in ('from_addresses', 'subject_keywords', 'body_keywords'):
+            for item in values[key]:
+                blocked_by = next((keyword for keyword in exclude if keyword in normalize_text(item)), None)
+                if blocked_by is not None:
+                    warnings.append(f"filters.{key} '{item}' nunca será encaminhado: "
+                                    f"contém a palavra excluída '{blocked_by}'")
+        
+        max_query_senders = filters.get('max_query_senders', 50)
+        if isinstance(max_query_senders, bool) or not isinstance(max_query_senders, int) or max_query_senders <= 0:
+            raise ValueError("filters.max_query_senders deve ser um inteiro positivo")
+        max_scan_chars = filters.get('pattern_max_scan_chars', 100000)
+        if isinstance(max_scan_chars, bool) or not isinstance(max_scan_chars, int) or max_scan_chars <= 0:
+            raise ValueError("filters.pattern_max_scan_chars deve ser um inteiro positivo")
+        # Nome antigo: não era um limite de tempo, só o limiar do aviso de lentidão
+        slow_key = 'pattern_slow_ms'
+        if 'pattern_timeout_ms' in filters and slow_key not in filters:
+            slow_key = 'pattern_timeout_ms'
+            warnings.append("filters.pattern_timeout_ms foi renomeado para pattern_slow_ms "
+                            "(não interrompe a varredura, só registra padrões lentos)")
+        slow_ms = filters.get(slow_key, 50)
+        if isinstance(slow_ms, bool) or not isinstance(slow_ms, (int, float)) or slow_ms <= 0:
+            raise ValueError(f"filters.{slow_key} deve ser um número positivo")
+        
+        patterns = PatternMatcher.compile_rules(
+            filters.get('patterns', []), max_scan_chars=max_scan_chars, slow_ms=slow_ms)
+        
+        for matcher in patterns['include'] + patterns['exclude']:
+            warnings.extend(matcher.warnings)
+        
+        headers = HeaderPredicate.compile_rules(filters.get('headers', []))
+        
+        query_labels = filters.get('query_labels', [])
+        if not isinstance(query_labels, list) or not all(isinstance(label, str) for label in query_labels):
+            raise ValueError("filters.query_labels deve ser uma lista de textos")
+        
+        return cls(include_patterns=patterns['include'], exclude_patterns=patterns['exclude'],
+                   include_headers=headers['include'], exclude_headers=headers['exclude'],
+                   max_query_senders=max_query_senders, query_labels=query_labels,
+                   max_age_hours=max_age_hours, warnings=warnings, **values)
+
+    
+    def build_checks(self):
+        """Monta as verificações independentes na ordem inicial da configuração"""
+        checks = []
+        
+        if self.exclude_headers:
+            def check_exclude_headers(record):
+                for predicate in self.exclude_headers:
+                    if predicate.matches(record):
+                        return f"cabeçalho excluído: {predicate.name}"
+            checks.append(FilterCheck('headers exclude', check_exclude_headers, needs_text=False))
+        
+        if self.include_headers:
+            def check_include_headers(record):
+                if not any(predicate.matches(record) for predicate in self.include_headers):
+                    return "nenhuma condição de cabeçalho satisfeita"
+            checks.append(FilterCheck('headers include', check_include_headers, needs_text=False))
+        
+        if self.senders:
+            def check_senders(record):
+                if not self.senders.matches(record.sender_address, record.sender):
+                    return f"remetente fora de from_addresses: {record.sender_address}"
+            checks.append(FilterCheck('from_addresses', check_senders, needs_text=False))
+        
+        if self.exclude_keywords:
+            def check_exclude_keywords(record):
+                keyword = self.exclude_keywords.search(record.text)
+                if keyword is not None:
+                    return f"palavra-chave excluída: {keyword}"
+            checks.append(FilterCheck('exclude_keywords', check_exclude_keywords))
+        
+        for matcher in self.exclude_patterns:
+            def check_exclude_pattern(record, matcher=matcher):
+                name = matcher.match(record)
+                if name is not None:
+                    return f"padrão excluído: {name}"
+            checks.append(FilterCheck(f'patterns exclude {matcher.kind}:{matcher.field}',
+                                      check_exclude_pattern, needs_text=matcher.field in ('text', 'body')))
+        
+        if self.body_keywords:
+            def check_body_keywords(record):
+                if self.body_keywords.search(record.text, record.body_start) is None:
+                    return "nenhuma palavra-chave do corpo encontrada"
+            checks.append(FilterCheck('body_keywords', check_body_keywords))
+        
+        if self.include_patterns:
+            def check_include_patterns(record):
+                if not any(matcher.match(record) is not None for matcher in self.include_patterns):
+                    return "nenhum padrão encontrado"
+            checks.append(FilterCheck('patterns include', check_include_patterns,
+                                      needs_text=any(matcher.field in ('text', 'body')
+                                                     for matcher in self.include_patterns)))
+        
+        return checks
+    
+    def evaluate(self, record, phase=None):
+        """Avalia o registro e retorna um ``FilterDecision``
+        
+        Todas as verificações precisam passar, então a ordem não muda o
+        resultado; periodicamente elas são reordenadas para que as mais
+        baratas e que mais rejeitam rodem primeiro.
+        
+        Args:
+            record (EmailRecord): Email a avaliar
+            phase (str): 'metadata' roda só as verificações de cabeçalho,
+                'content' só as que usam o texto; None roda todas
+        """
+        decision = FilterDecision(True, None)
+        record.sender_address
+        for check in self.schedule.checks:
+            if phase is not None and check.needs_text != (phase == 'content'):
+                continue
+            if check.needs_text:
+                record.text
+            reason = check.run(record)
+            if reason is not None:
+                decision = FilterDecision(False, reason)
+                break
+        
+        self.schedule.record_evaluation()
+        return decision
+    
+    def statistics(self):
+        """Estatísticas de custo e seletividade de cada verificação, na ordem atual"""
+        return self.schedule.statistics()
+    
+    def find_matches(self, record):
+        """Lista todas as palavras-chave e padrões que casam com o registro
+        
+        Ao contrário de ``evaluate``, não para na primeira regra: usado pelo
+        replay para contar quantos emails cada regra de inclusão ou exclusão
+        alcança.
+        
+        Returns:
+            list: rótulos como ``'body_keywords: fatura'`` ou ``'patterns include: pedidos'``
+        """
+        matches = []
+        if self.exclude_keywords:
+            matches.extend(f"exclude_keywords: {keyword}"
+                           for keyword in self.exclude_keywords.find_all(record.text))
+        if self.body_keywords:
+            matches.extend(f"body_keywords: {keyword}"
+                           for keyword in self.body_keywords.find_all(record.text, record.body_start))
+        for action, matchers in (('include', self.include_patterns), ('exclude', self.exclude_patterns)):
+            for matcher in matchers:
+                matches.extend(f"patterns {action}: {name}" for name in matcher.find_all(record))
+        return matches
+
+
+class SenderIndex:
+    """Índice de remetentes: endereços, usuários, domínios e curingas de subdomínio
+    
+    Endereços (``user@dominio``), usuários (``user@``) e domínios (``@dominio``
+    ou ``dominio``) ficam em tabelas hash. Curingas (``*.example.com``) ficam
+    em uma trie de rótulos invertidos (com → example → *), percorrida em
+    O(número de rótulos) do domínio do remetente. Cada entrada guarda os
+    valores associados (ex.: índices de rotas).
+    
+    Entradas sem ``@`` nem ``.`` (ex.: um nome) são comparadas como trecho do
+    remetente completo, como a busca ``from:`` do Gmail.
+    """
+    WILDCARD = '*'
+    
+    def __init__(self, patterns=()):
+        self.addresses = {}
+        self.local_parts = {}
+        self.domains = {}
+        self.wildcards = {}
+        self.terms = {}
+        self.patterns = []
+        for pattern in patterns:
+            self.add(pattern)
+    
+    def add(self, pattern, value=True):
+        """Adiciona um padrão de remetente associado a ``value``"""
+        pattern = normalize_text(pattern.strip())
+        if not pattern:
+            return
+        self.patterns.append(pattern)
+        
+        if pattern.startswith('*.'):
+            node = self.wildcards
+            for label in reversed(pattern[2:].split('.')):
+                node = node.setdefault(label, {})
+            node.setdefault(self.WILDCARD, []).append(value)
+            return
+        
+        local, at, domain = pattern.rpartition('@')
+        if not at:
+            if '.' in domain:
+                self.domains.setdefault(domain, []).append(value)
+            else:
+                self.terms.setdefault(domain, []).append(value)
+        elif not domain:
+            self.local_parts.setdefault(local, []).append(value)
+        elif not local or local == '*':
+            self.domains.setdefault(domain, []).append(value)
+        else:
+            self.addresses.setdefault(pattern, []).append(value)
+    
+    def __bool__(self):
+        return bool(self.patterns)
+    
+    def __len__(self):
+        return len(self.patterns)
+    
+    def lookup(self, address, sender=''):
+        """Retorna os valores de todas as entradas que casam com o endereço
+        
+        Args:
+            address (str): Endereço do remetente em minúsculas
+            sender (str): Remetente completo (com nome), usado pelos trechos
+        """
+        local, _, domain = address.rpartition('@')
+        found = []
+        found.extend(self.addresses.get(address, ()))
+        found.extend(self.local_parts.get(local, ()))
+        found.extend(self.domains.get(domain, ()))
+        
+        if self.wildcards and domain:
+            node = self.wildcards
+            labels = domain.split('.')
+            for depth, label in enumerate(reversed(labels), 1):
+                node = node.get(label)
+                if node is None:
+                    break
+                # O curinga exige pelo menos mais um rótulo (sub.example.com)
+                if depth < len(labels) and self.WILDCARD in node:
+                    found.extend(node[self.WILDCARD])
+        
+        if self.terms:
+            sender = normalize_text(sender or address)
+            for term, values in self.terms.items():
+                if term in sender:
+                    found.extend(values)
+        return found
+    
+    def matches(self, address, sender=''):
+        """Verifica se algum padrão casa com o remetente"""
+        return bool(self.lookup(address, sender))
+    
+    def gmail_query(self, max_terms=50, max_length=1000, labels=()):
+        """Monta a cláusula ``from:`` da busca no Gmail mantendo-a compacta
+        
+        Com muitos remetentes, a cláusula passa a usar apenas domínios; se
+        ainda for grande demais, usa os marcadores informados (``label:``) ou
+        é omitida e o filtro fica só no lado do cliente.
+        
+        Returns:
+            str: Cláusula entre parênteses ou '' quando não há restrição
+        """
+        def clause(terms):
+            text = ' OR '.join(terms)
+            if len(terms) <= max_terms and len(text) <= max_length:
+                return f'({text})'
+            return None
+        
+        wildcard_domains = []
+        
+        def collect(node, labels):
+            for label, child in node.items():
+                if label == self.WILDCARD:
+                    wildcard_domains.append('.'.join(reversed(labels)))
+                else:
+                    collect(child, labels + [label])
+        
+        collect(self.wildcards, [])
+        
+        # 1. Todos os remetentes como foram configurados
+        terms = ([f'from:{address}' for address in self.addresses] +
+                 [f'from:{local}@' for local in self.local_parts] +
+                 [f'from:{domain}' for domain in self.domains] +
+                 [f'from:{domain}' for domain in wildcard_domains] +
+                 [f'from:{term}' for term in self.terms])
+        query = clause(terms)
+        if query is not None:
+            return query
+        
+        # 2. Apenas domínios (usuários e trechos não podem ser agrupados)
+        if not self.local_parts and not self.terms:
+            domains = dict.fromkeys(
+                [address.rpartition('@')[2] for address in self.addresses] +
+                list(self.domains) + wildcard_domains)
+            query = clause([f'from:{domain}' for domain in domains])
+            if query is not None:
+                logging.info(f"Busca no Gmail agrupada em {len(domains)} domínios "
+                             f"({len(self)} remetentes)")
+                return query
+        
+        # 3. Marcadores configurados ou nenhum filtro no servidor
+        if labels:
+            return clause([f'label:{label}' for label in labels]) or ''
+        logging.info(f"{len(self)} remetentes: filtro de remetente aplicado só no cliente")
+        return ''
+
+# O Telegram aceita até 4096 unidades UTF-16 de texto visível (depois de
+# interpretar a marcação); emojis fora do BMP contam como 2
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def utf16_length(text):
+    """Tamanho de ``text`` como o Telegram conta (unidades UTF-16)"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+def is_grapheme_extender(char):
+    """Caracteres que se juntam ao anterior no mesmo grafema"""
+    return (unicodedata.category(char) in ('Mn', 'Me', 'Mc') or char == '\u200d'
+            or '\ufe00' <= char <= '\ufe0f'                  # seletores de variação
+            or '\U0001f3fb' <= char <= '\U0001f3ff'          # tons de pele
+            or '\U000e0020' <= char <= '\U000e007f')         # tags (bandeiras regionais)
+
+def is_regional_indicator(char):
+    return '\U0001f1e6' <= char <= '\U0001f1ff'
+
+def is_grapheme_boundary(text, index):
+    """Indica se ``text`` pode ser cortado antes de ``text[index]``
+    
+    Aproximação do UAX #29 suficiente para cortar mensagens: não separa
+    acentos combinantes, sequências com ZWJ, seletores de variação, tons de
+    pele, pares de bandeira nem CR LF.
+    """
+    if index <= 0 or index >= len(text):
+        return True
+    previous, char = text[index - 1], text[index]
+    if char.isascii() and previous.isascii():
+        return not (previous == '\r' and char == '\n')
+    if previous == '\u200d' or is_grapheme_extender(char):
+        return False
+    if is_regional_indicator(previous) and is_regional_indicator(char):
+        # Bandeiras são pares: só há fronteira depois de um número par
+        count = 0
+        while index - count > 0 and is_regional_indicator(text[index - count - 1]):
+            count += 1
+        return count % 2 == 0
+    return True
+
+def truncate_utf16(text, limit, suffix="..."):
+    """Corta ``text`` para caber em ``limit`` unidades UTF-16 (com ``suffix``)
+    
+    O corte é feito no texto ainda sem escape e numa fronteira de grafema,
+    então nunca separa uma sequência de escape, um par substituto ou um emoji
+    composto.
+    """
+    if text.isascii():
+        if len(text) <= limit:
+            return text
+        encoded = None
+    else:
+        # Codificado uma só vez: serve para medir e para achar o corte
+        encoded = text.encode('utf-16-le')
+        if len(encoded) <= limit * 2:
+            return text
+    budget = limit - len(suffix)
+    if budget <= 0:
+        return suffix[:max(limit, 0)]
+    
+    if encoded is None or len(encoded) == len(text) * 2:
+        cut = budget
+    else:
+        # Decodificar o prefixo descarta um par substituto cortado ao meio
+        cut = len(encoded[:budget * 2].decode('utf-16-le', errors='ignore'))
+    while cut > 0 and not is_grapheme_boundary(text, cut):
+        cut -= 1
+    return text[:cut] + suffix
+
+# Fins de frase (com aspas ou parênteses de fechamento) seguidos de espaço
+SENTENCE_END = re.compile(r'[.!?…][)"\'»”]*\s')
+LEADING_SPACE = re.compile(r'\s*')
+
+def utf16_prefix_end(text, start, budget):
+    """Maior ``end`` tal que ``text[start:end]`` cabe em ``budget`` unidades UTF-16"""
+    window = text[start:start + max(budget, 0)]
+    if window.isascii():
+        return start + len(window)
+    return start + len(window.encode('utf-16-le')[:budget * 2].decode('utf-16-le', errors='ignore'))
+
+def find_split_point(text, start, end):
+    """Melhor ponto de corte em ``text[start:end]``: parágrafo, linha, frase ou espaço
+    
+    Só aceita cortes na segunda metade do trecho, para não gerar partes
+    pequenas; sem nenhum deles, corta na última fronteira de grafema.
+    """
+    minimum = start + (end - start) // 2
+    for separator in ('\n\n', '\n'):
+        position = text.rfind(separator, minimum, end)
+        if position >= 0:
+            return position
+    
+    last = None
+    for last in SENTENCE_END.finditer(text, minimum, end):
+        pass
+    if last is not None:
+        return last.end()
+    
+    position = text.rfind(' ', minimum, end)
+    if position >= 0:
+        return position
+    
+    cut = end
+    while cut > start + 1 and not is_grapheme_boundary(text, cut):
+        cut -= 1
+    return cut
+
+def split_text(text, first_budget, budget, max_parts):
+    """Divide ``text`` em até ``max_parts`` partes (orçamentos em unidades UTF-16)
+    
+    A primeira parte cabe em ``first_budget`` e as demais em ``budget``. Se
+    o texto não couber em ``max_parts`` partes, a última termina em "...".
+    Todas as partes são calculadas de uma vez, antes de qualquer envio.
+    """
+    parts = []
+    start = 0
+    length = len(text)
+    limit = first_budget
+    while start < length:
+        end = utf16_prefix_end(text, start, limit)
+        if end >= length or len(parts) == max_parts - 1 or limit < 20:
+            parts.append(truncate_utf16(text[start:], limit))
+            break
+        
+        cut = find_split_point(text, start, end)
+        parts.append(text[start:cut].rstrip())
+        start = LEADING_SPACE.match(text, cut).end()
+        limit = budget
+    return parts
+
+def render_attachment_list(attachments, renderer, limit=None):
+    """Formata a lista de anexos (no máximo ``limit`` itens)
+    
+    Returns:
+        tuple: (texto formatado, tamanho visível em unidades UTF-16)
+    """
+    if not attachments:
+        return '', 0
+    
+    escape = renderer.escape
+    title = f"Anexos ({len(attachments)}):"
+    lines = [f"📎 {renderer.bold(escape(title))}\n"]
+    visible = [f"📎 {title}\n"]
+    for att in attachments[:limit]:
+        size_mb = att['size'] / (1024 * 1024) if att['size'] > 0 else 0
+        line = f"{att['filename']} ({size_mb:.1f} MB)"
+        lines.append(f"• {escape(line)}\n")
+        visible.append(f"• {line}\n")
+    if limit is not None and len(attachments) > limit:
+        line = f"… e mais {len(attachments) - limit}"
+        lines.append(f"{escape(line)}\n")
+        visible.append(f"{line}\n")
+    return ''.join(lines), utf16_length(''.join(visible))
+
+class MessageTemplate:
+    """Template de mensagem compilado uma vez por rota
+    
+    O texto fixo já está no parse_mode da rota; os campos são escapados pelo
+    renderizador da rota. ``{campo:N}`` limita o campo a N caracteres antes do
+    escape (em ``{attachments:N}``, a N anexos). A mensagem é montada em uma
+    lista e unida uma só vez; o corpo ocupa o espaço que sobrar.
+    
+    Tamanhos são contados como o Telegram conta: unidades UTF-16 do texto
+    visível, sem marcação nem escapes.
+    """
+    __slots__ = ('source', 'renderer', 'parts', 'text_fields', 'attachment_fields', 'body_fields',
+                 'has_body', 'fixed_length')
+    
+    # Campo do template -> atributo do EmailRecord
+    FIELDS = {'from': 'sender', 'to': 'to', 'subject': 'subject', 'date': 'date',
+              'body': None, 'attachments': None}
+    
+    def __init__(self, source, renderer, segments):
+        self.source = source
+        self.renderer = renderer
+        # Partes da mensagem com o texto fixo já preenchido; cada campo
+        # guarda a posição que ocupa, separado por tipo para o render
+        self.parts = [segment if type(segment) is str else '' for segment in segments]
+        fields = [(position,) + segment for position, segment in enumerate(segments)
+                  if type(segment) is tuple]
+        self.text_fields = tuple((position, attribute, limit)
+                                 for position, field, attribute, limit in fields if attribute is not None)
+        self.attachment_fields = tuple((position, limit)
+                                       for position, field, attribute, limit in fields if field == 'attachments')
+        self.body_fields = tuple((position, limit)
+                                 for position, field, attribute, limit in fields if field == 'body')
+        self.has_body = bool(self.body_fields)
+        self.fixed_length = sum(utf16_length(renderer.plain(part)) for part in self.parts if part)
+    
+    @staticmethod
+    def default_source(renderer, include_body=True):
+        """Layout padrão (cabeçalho, conteúdo e anexos) no parse_mode do renderizador"""
+        bold = renderer.bold
+        source = (f"📧 {bold('Novo Email')}\n\n"
+                  f"{bold('De:')} {{from}}\n"
+                  f"{bold('Assunto:')} {{subject}}\n"
+                  f"{bold('Data:')} {{date}}\n\n")
+        if include_body:
+            source += f"{bold('Conteúdo:')}\n{{body}}\n\n"
+        return source + "{attachments}"
+    
+    @classmethod
+    def compile(cls, source, renderer, where):
+        """Valida e compila o texto de um template"""
+        if not isinstance(source, str):
+            raise ValueError(f"{where}: 'template' deve ser um texto")
+        try:
+            parsed = list(string.Formatter().parse(source))
+        except ValueError as e:
+            raise ValueError(f"{where}: template inválido: {e}") from None
+        
+        segments = []
+        for literal, field, spec, conversion in parsed:
+            if literal:
+                segments.append(literal)
+            if field is None:
+                continue
+            if field not in cls.FIELDS:
+                raise ValueError(f"{where}: campo desconhecido no template: {{{field}}} "
+                                 f"(use {', '.join(cls.FIELDS)})")
+            if conversion or (spec and not spec.isdigit()):
+                raise ValueError(f"{where}: formato inválido em {{{field}}}; use {{{field}:N}} "
+                                 f"para limitar a N caracteres")
+            segments.append((field, cls.FIELDS[field], int(spec) if spec else None))
+        
+        template = cls(source, renderer, segments)
+        if template.fixed_length > TELEGRAM_MESSAGE_LIMIT:
+            raise ValueError(f"{where}: o texto fixo do template tem {template.fixed_length} caracteres; "
+                             f"o Telegram aceita até {TELEGRAM_MESSAGE_LIMIT}")
+        return template
+    
+    def render(self, record, body, max_length, max_parts=1):
+        """Monta a mensagem do email (``body`` já sem citações e assinatura)
+        
+        Os campos são cortados antes do escape; se só os campos já passam de
+        ``max_length`` (ex.: assunto enorme), os maiores são encurtados e, em
+        último caso, a lista de anexos sai. O corpo fica com o que sobrar.
+        
+        Com ``max_parts`` > 1, um corpo que não cabe é dividido: a primeira
+        mensagem segue o template e as seguintes trazem só a continuação do
+        corpo, todas marcadas com "(i/n)".
+        
+        Returns:
+            list: Mensagens na ordem de envio
+        """
+        renderer = self.renderer
+        parts = self.parts[:]
+        used = self.fixed_length
+        texts = []
+        for position, attribute, limit in self.text_fields:
+            value = getattr(record, attribute)
+            if limit is not None:
+                value = truncate_utf16(value, limit)
+            length = utf16_length(value)
+            texts.append((position, value, length))
+            used += length
+        lists = []
+        for position, limit in self.attachment_fields:
+            parts[position], length = render_attachment_list(record.attachments, renderer, limit)
+            lists.append((position, length))
+            used += length
+        
+        if used > max_length:
+            values = {position: value for position, value, length in texts}
+            lengths = {position: length for position, *rest, length in sorted(texts + lists)}
+            for position in sorted(lengths, key=lengths.get, reverse=True):
+                excess = used - max_length
+                if excess <= 0:
+                    break
+                if position in values:
+                    values[position] = truncate_utf16(values[position], max(lengths[position] - excess, 0))
+                    used -= lengths[position] - utf16_length(values[position])
+                else:
+                    parts[position] = ''
+                    used -= lengths[position]
+            texts = [(position, value, None) for position, value in values.items()]
+        
+        escape = renderer.escape
+        for position, value, length in texts:
+            parts[position] = escape(value)
+        
+        body_slots = self.body_fields
+        if body_slots and body:
+            budget = max(max_length - used, 0) // len(body_slots)
+            if (max_parts > 1 and len(body_slots) == 1 and body_slots[0][1] is None
+                    and utf16_length(body) > budget):
+                # Reserva espaço para o marcador "(i/n)" em todas as partes
+                marker = len(f"\n\n({max_parts}/{max_parts})")
+                chunks = split_text(body, budget - marker, max_length - marker, max_parts)
+                if len(chunks) > 1:
+                    total = len(chunks)
+                    parts[body_slots[0][0]] = escape(f"{chunks[0]}\n\n(1/{total})")
+                    messages = [''.join(parts)]
+                    messages.extend(escape(f"({index}/{total})\n\n{chunk}")
+                                    for index, chunk in enumerate(chunks[1:], 2))
+                    return messages
+            
+            for position, limit in body_slots:
+                size = budget if limit is None else min(budget, limit)
+                parts[position] = escape(truncate_utf16(body, size))
+        
+        return [''.join(parts)]
+
+class Route:
+    """Regra de roteamento: condições, chat de destino e template da mensagem"""
+    __slots__ = ('index', 'name', 'chat_id', 'template', 'reply_trimmer', 'renderer',
+                 'senders', 'subject_keywords', 'keywords', 'headers')
+    
+    def __init__(self, index, name, chat_id, template=None, reply_trimmer=None, renderer=None,
+                 senders=(), subject_keywords=(), keywords=(), headers=()):
+        self.index = index
+        self.name = name
+        self.chat_id = chat_id
+        self.renderer = renderer or RENDERERS['MarkdownV2']
+        self.template = template or MessageTemplate.compile(
+            MessageTemplate.default_source(self.renderer), self.renderer, f"Rota '{name}'")
+        self.reply_trimmer = reply_trimmer
+        
+        # Remetentes: "user@dominio" (endereço), "user@" (qualquer domínio),
+        # "@dominio" (qualquer usuário) e "*.dominio" (subdomínios)
+        self.senders = SenderIndex(senders)
+        self.subject_keywords = KeywordAutomaton(subject_keywords)
+        self.keywords = KeywordAutomaton(keywords)
+        self.headers = tuple(headers)
+    
+    @property
+    def has_sender_conditions(self):
+        return bool(self.senders)
+    
+    @classmethod
+    def compile(cls, index, rule, default_chat_id, default_renderer=None, default_template=None,
+                full_email=True):
+        """Valida e compila uma entrada de ``routes``
+        
+        Sem ``template`` na rota vale ``default_template`` (``settings.template``)
+        ou o layout padrão, sempre compilado no parse_mode da rota.
+        """
+        if not isinstance(rule, dict):
+            raise ValueError(f"routes[{index}] deve ser um objeto")
+        name = str(rule.get('name', f'rota {index + 1}'))
+        
+        for key in ('from', 'subject_keywords', 'keywords'):
+            items = rule.get(key, [])
+            if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+                raise ValueError(f"Rota '{name}': '{key}' deve ser uma lista de textos")
+        
+        reply_trimmer = None
+        if 'trimming' in rule:
+            reply_trimmer = ReplyTrimmer.from_config(rule['trimming'], f"Rota '{name}': trimming") or ReplyTrimmer.DISABLED
+        
+        headers = rule.get('headers', [])
+        if not isinstance(headers, list):
+            raise ValueError(f"Rota '{name}': 'headers' deve ser uma lista de condições")
+        headers = [HeaderPredicate.compile(f"Rota '{name}': headers[{position}]", condition)
+                   for position, condition in enumerate(headers)]
+        
+        renderer = default_renderer or RENDERERS['MarkdownV2']
+        if 'parse_mode' in rule:
+            renderer = get_renderer(rule['parse_mode'], f"Rota '{name}'")
+        
+        template = rule.get('template', default_template)
+        if template is None:
+            template = MessageTemplate.default_source(renderer, include_body=full_email)
+        template = MessageTemplate.compile(template, renderer, f"Rota '{name}'")
+        
+        return cls(index, name, str(rule.get('chat_id', default_chat_id)), template, reply_trimmer, renderer,
+                   senders=rule.get('from', []),
+                   subject_keywords=rule.get('subject_keywords', []),
+                   keywords=rule.get('keywords', []),
+                   headers=headers)
+    
+    def matches(self, record, check_sender=True):
+        """Verifica se o registro satisfaz todas as condições da rota"""
+        if (check_sender and self.senders and
+                not self.senders.matches(record.sender_address, record.sender)):
+            return False
+        if not all(predicate.matches(record) for predicate in self.headers):
+            return False
+        if self.subject_keywords and self.subject_keywords.search(normalize_text(record.subject)) is None:
+            return False
+        if self.keywords and self.keywords.search(record.text) is None:
+            return False
+        return True
+
+class Router:
+    """Escolhe a rota de cada email (a primeira regra que casar, na ordem do config)
+    
+    Regras com condição de remetente ficam em um ``SenderIndex`` (tabelas hash
+    por endereço, usuário e domínio e trie de curingas); só as regras
+    encontradas para o remetente e as regras sem condição de remetente são
+    avaliadas.
+    """
+    
+    def __init__(self, routes, default_route):
+        self.routes = tuple(routes)
+        self.default_route = default_route
+        self.senders = SenderIndex()
+        self.unindexed = []
+        
+        for route in self.routes:
+            if not route.has_sender_conditions:
+                self.unindexed.append(route.index)
+                continue
+            for pattern in route.senders.patterns:
+                self.senders.add(pattern, route.index)
+    
+    @classmethod
+    def compile(cls, config):
+        """Compila a seção ``routes`` do config.json"""
+        default_chat_id = str(config['telegram']['chat_id'])
+        rules = config.get('routes', [])
+        if not isinstance(rules, list):
+            raise ValueError("A seção 'routes' deve ser uma lista")
+        
+        renderer = get_renderer(config['telegram'].get('parse_mode', 'MarkdownV2'), "telegram")
+        settings = config.get('settings', {})
+        template = settings.get('template')
+        full_email = settings.get('send_full_email', True)
+        
+        routes = [Route.compile(index, rule, default_chat_id, renderer, template, full_email)
+                  for index, rule in enumerate(rules)]
+        if template is None:
+            template = MessageTemplate.default_source(renderer, include_body=full_email)
+        template = MessageTemplate.compile(template, renderer, "settings.template")
+        return cls(routes, Route(-1, 'padrão', default_chat_id, template, renderer=renderer))
+    
+    @property
+    def header_names(self):
+        """Cabeçalhos lidos pelas condições ``headers`` das rotas (minúsculas)"""
+        return frozenset(predicate.header.lower() for route in self.routes for predicate in route.headers)
+    
+    def renderer_for(self, chat_id):
+        """Renderizador usado no chat (o da primeira rota que envia para ele)"""
+        for route in self.routes:
+            if route.chat_id == chat_id:
+                return route.renderer
+        return self.default_route.renderer
+    
+    def candidates(self, record):
+        """Índices das regras que podem casar com o remetente, em ordem"""
+        found = self.senders.lookup(record.sender_address, record.sender)
+        if not found:
+            return self.unindexed
+        return sorted(set(found).union(self.unindexed))
+    
+    def route(self, record):
+        """Retorna a rota do registro (ou a rota padrão)"""
+        for index in self.candidates(record):
+            route = self.routes[index]
+            if route.matches(record, check_sender=False):
+                return route
+        return self.default_route
+
+# Emails baixados à frente do processamento, por processo do pool de parsing
+PARSE_READ_AHEAD_PER_WORKER = 4
+
+def parse_message(message, options=None):
+    """Extrai corpo e anexos de uma mensagem e retorna o registro sem o payload
+    
+    Função de módulo para poder ser executada em um ProcessPoolExecutor.
+    """
+    record = EmailRecord.from_message(message, options)
+    record.body
+    record.attachments
+    return record
+
+class ReplyTrimmer:
+    """Remove histórico citado e assinaturas do corpo antes do escape e do corte
+    
+    Desativado por padrão: é ligado com ``"enabled": true`` na seção
+    ``settings.trimming`` do config.json, onde cada regra também pode ser
+    ligada/desligada. As regras de corte são compiladas em uma única expressão,
+    então o corpo é percorrido uma vez para achar o primeiro ponto de corte.
+    """
+    
+    # Regras que marcam o início do histórico ou da assinatura (corta dali em diante)
+    CUT_RULES = {
+        'reply_headers': (
+            r'^[ \t]*(?:Em|On)\b[^\n]{0,200}(?:\n[^\n]{0,200})?\b(?:escreveu|wrote):[ \t]*$'
+        ),
+        'outlook_separators': (
+            r'^[ \t]*(?:-{3,}[ \t]*(?:Original Message|Mensagem original|Mensagem Original)[ \t]*-{3,}'
+            r'|_{20,}[ \t]*\n[ \t]*(?:De|From):'
+            r'|(?:De|From):[^\n]*\n[ \t]*(?:Enviado|Enviada|Sent):[^\n]*\n[ \t]*(?:Para|To):)'
+        ),
+        # Só "-- " (com o espaço) delimita assinatura; "--" sozinho é comum no texto
+        'signatures': (
+            r'^(?:-- '
+            r'|(?:Enviado|Enviada) (?:do|a partir do|pelo) (?:meu )?[^\n]{1,40}'
+            r'|Sent from (?:my )?[^\n]{1,40}'
+            r'|Get Outlook for [^\n]{1,40})[ \t]*$'
+        ),
+    }
+    
+    # Linhas citadas com ">" (removidas onde estiverem)
+    QUOTED_LINE = re.compile(r'^[ \t]*>[^\n]*(?:\n|\Z)', re.MULTILINE)
+    EXTRA_BLANK_LINES = re.compile(r'\n[ \t]*\n(?:[ \t]*\n)+')
+    
+    def __init__(self, quoted_lines=True, reply_headers=True,
+                 outlook_separators=True, signatures=True):
+        self.quoted_lines = quoted_lines
+        enabled = {
+            'reply_headers': reply_headers,
+            'outlook_separators': outlook_separators,
+            'signatures': signatures,
+        }
+        patterns = [f'(?P<{name}>{pattern})' for name, pattern in self.CUT_RULES.items()
+                    if enabled[name]]
+        self.cut_pattern = re.compile('|'.join(patterns), re.MULTILINE) if patterns else None
+    
+    @classmethod
+    def from_config(cls, options, where='settings.trimming'):
+        """Cria o trimmer a partir de ``settings.trimming`` (None se desativado)
+        
+        O corte é opcional: sem ``"enabled": true`` o corpo segue inteiro.
+        
+        Raises:
+            ValueError: se a opção não for true/false ou um objeto de booleanos
+        """
+        if options is None:
+            options = {}
+        elif isinstance(options, bool):
+            options = {'enabled': options}
+        elif not isinstance(options, dict):
+            raise ValueError(f"{where} deve ser true/false ou um objeto")
+        
+        flags = {}
+        for key in ('enabled', 'quoted_lines', 'reply_headers', 'outlook_separators', 'signatures'):
+            value = options.get(key, key != 'enabled')
+            if not isinstance(value, bool):
+                raise ValueError(f"{where}.{key} deve ser true ou false")
+            flags[key] = value
+        
+        if not flags.pop('enabled'):
+            return None
+        return cls(**flags)
+    
+    def trim(self, body):
+        """Retorna o corpo sem citações e assinatura
+        
+        Se o corte deixar o corpo vazio (ex.: email que é só uma citação),
+        o corpo original é mantido.
+        """
+        if not body:
+            return body
+        
+        trimmed = body
+        if self.cut_pattern is not None:
+            match = self.cut_pattern.search(trimmed)
+            if match:
+                trimmed = trimmed[:match.start()]
+        
+        if self.quoted_lines and '>' in trimmed:
+            trimmed = self.QUOTED_LINE.sub('', trimmed)
+            trimmed = self.EXTRA_BLANK_LINES.sub('\n\n', trimmed)
+        
+        if not trimmed.strip():
+            return body
+        return trimmed
+
+# Usado por rotas que desativam a remoção de citações
+ReplyTrimmer.DISABLED = ReplyTrimmer(quoted_lines=False, reply_headers=False,
+                                     outlook_separators=False, signatures=False)
+
+WORD = re.compile(r'\w+')
+DIGITS = re.compile(r'\d+')
+SIMHASH_BITS = 64
+SIMHASH_MAX_SHINGLES = 4096
+
+# Bytes com o bit ``b`` ligado, para contar bits de uma coluna com bytes.translate
+SIMHASH_BIT_BYTES = [bytes(value for value in range(256) if value >> bit & 1) for bit in range(8)]
+
+def simhash(text, shingle_size=3):
+    """Impressão SimHash de 64 bits sobre shingles de palavras do texto
+    
+    Textos quase iguais geram impressões com poucos bits diferentes
+    (distância de Hamming pequena). O texto deve estar normalizado;
+    números são igualados para que alertas que só mudam valores,
+    horários ou ids gerem a mesma impressão.
+    """
+    words = WORD.findall(DIGITS.sub('0', text))
+    if len(words) < shingle_size:
+        shingles = set(words)
+    else:
+        shingles = set(' '.join(words[i:i + shingle_size])
+                       for i in range(min(len(words) - shingle_size + 1, SIMHASH_MAX_SHINGLES)))
+    if not shingles:
+        return 0
+    
+    # Hashes de 8 bytes concatenados; cada coluna de bytes é contada de uma
+    # vez (bytes.translate remove os bytes com o bit ligado) em vez de
+    # percorrer os 64 bits de cada shingle
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+                       for shingle in shingles)
+    count = len(shingles)
+    fingerprint = 0
+    for position in range(8):
+        column = digests[position::8]
+        for bit, selected in enumerate(SIMHASH_BIT_BYTES):
+            # Bit ligado quando a maioria dos shingles tem o bit ligado
+            if (count - len(column.translate(None, selected))) * 2 > count:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class DuplicateEntry:
+    """Email encaminhado mantido na janela de deduplicação"""
+    
+    __slots__ = ('fingerprint', 'scope', 'label', 'timestamp', 'suppressed', 'reported', 'keys')
+    
+    def __init__(self, fingerprint, scope, label, timestamp, keys):
+        self.fingerprint = fingerprint
+        self.scope = scope
+        self.label = label
+        self.timestamp = timestamp
+        self.suppressed = 0
+        self.reported = 0
+        self.keys = keys
+
+class DuplicateIndex:
+    """Janela deslizante de impressões SimHash já encaminhadas
+    
+    Cada impressão é dividida em ``max_distance + 1`` faixas de bits: duas
+    impressões a até ``max_distance`` bits de distância coincidem em pelo
+    menos uma faixa, então a busca só compara os candidatos dessas faixas.
+    O escopo (chat de destino) faz parte da chave: o mesmo alerta enviado
+    a chats diferentes não é suprimido.
+    """
+    
+    def __init__(self, max_distance=6, window_seconds=3600, max_entries=5000):
+        self.max_distance = max_distance
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.parameters = (max_distance, window_seconds, max_entries)
+        
+        bands = max_distance + 1
+        width = SIMHASH_BITS // bands
+        self.bands = [(band * width, width if band < bands - 1 else SIMHASH_BITS - band * width)
+                      for band in range(bands)]
+        self.entries = deque()
+        self.buckets = {}
+    
+    @classmethod
+    def from_settings(cls, options):
+        """Cria o índice a partir de ``settings.deduplicate`` (None se desativado)
+        
+        Raises:
+            ValueError: se algum parâmetro for inválido
+        """
+        if options is None or options is False:
+            return None
+        if options is True:
+            options = {}
+        if not isinstance(options, dict):
+            raise ValueError("settings.deduplicate deve ser true/false ou um objeto")
+        if not options.get('enabled', True):
+            return None
+        
+        max_distance = options.get('max_distance', 6)
+        window_minutes = options.get('window_minutes', 60)
+        max_entries = options.get('max_entries', 5000)
+        if isinstance(max_distance, bool) or not isinstance(max_distance, int) or not 0 <= max_distance <= 15:
+            raise ValueError("settings.deduplicate.max_distance deve ser um inteiro entre 0 e 15")
+        if isinstance(window_minutes, bool) or not isinstance(window_minutes, (int, float)) or window_minutes <= 0:
+            raise ValueError("settings.deduplicate.window_minutes deve ser um número positivo")
+        if isinstance(max_entries, bool) or not isinstance(max_entries, int) or max_entries <= 0:
+            raise ValueError("settings.deduplicate.max_entries deve ser um inteiro positivo")
+        return cls(max_distance, window_minutes * 60, max_entries)
+    
+    def band_keys(self, fingerprint, scope):
+        return [(scope, index, (fingerprint >> start) & ((1 << width) - 1))
+                for index, (start, width) in enumerate(self.bands)]
+    
+    def expire(self, now):
+        """Remove entradas fora da janela ou além do limite de tamanho"""
+        limit = now - self.window_seconds
+        while self.entries and (self.entries[0].timestamp < limit or
+                                len(self.entries) > self.max_entries):
+            entry = self.entries.popleft()
+            for key in entry.keys:
+                bucket = self.buckets[key]
+                bucket.remove(entry)
+                if not bucket:
+                    del self.buckets[key]
+    
+    def find(self, fingerprint, scope, now=None):
+        """Procura uma entrada parecida já encaminhada ao mesmo escopo
+        
+        Não registra o email: a entrada só é criada por ``add``, depois que o
+        envio deu certo. Uma entrada encontrada conta mais um email suprimido.
+        
+        Returns:
+            DuplicateEntry ou None: entrada semelhante (o email deve ser
+            suprimido) ou None se o email é novo
+        """
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        
+        for key in self.band_keys(fingerprint, scope):
+            for entry in self.buckets.get(key, ()):
+                if hamming_distance(entry.fingerprint, fingerprint) <= self.max_distance:
+                    entry.suppressed += 1
+                    return entry
+        return None
+    
+    def add(self, fingerprint, scope, label, now=None):
+        """Registra um email encaminhado com sucesso"""
+        if now is None:
+            now = time.time()
+        keys = self.band_keys(fingerprint, scope)
+        entry = DuplicateEntry(fingerprint, scope, label, now, keys)
+        self.entries.append(entry)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(entry)
+        self.expire(now)
+    
+    def adopt(self, previous):
+        """Herda as entradas de um índice substituído ao recarregar a configuração
+        
+        As chaves das faixas são recalculadas com os novos parâmetros; os
+        contadores de suprimidos ainda não informados seguem nas entradas.
+        """
+        for entry in previous.entries:
+            entry.keys = self.band_keys(entry.fingerprint, entry.scope)
+            self.entries.append(entry)
+            for key in entry.keys:
+                self.buckets.setdefault(key, []).append(entry)
+    
+    def pending_reports(self):
+        """Entradas com emails suprimidos ainda não informados"""
+        reports = []
+        for entry in self.entries:
+            if entry.suppressed > entry.reported:
+                reports.append((entry, entry.suppressed - entry.reported))
+                entry.reported = entry.suppressed
+        return reports
+    
+    def __len__(self):
+        return len(self.entries)
+
+class SenderWindow:
+    """Janela deslizante de um remetente: envios recentes e emails retidos"""
+    
+    __slots__ = ('limit', 'sender', 'sent', 'held', 'held_count')
+    
+    MAX_HELD_SUBJECTS = 20
+    
+    def __init__(self, limit, sender=''):
+        self.limit = limit
+        self.sender = sender
+        self.sent = deque()
+        self.held = {}
+        self.held_count = 0
+    
+    def prune(self, now):
+        window = self.limit[1]
+        while self.sent and self.sent[0] <= now - window:
+            self.sent.popleft()
+    
+    def has_room(self, now):
+        """Verifica se a janela ainda permite um envio"""
+        self.prune(now)
+        return len(self.sent) < self.limit[0]
+    
+    def hold(self, chat_id, subject):
+        """Retém um email (só os primeiros assuntos de cada chat são guardados)"""
+        self.held_count += 1
+        entry = self.held.setdefault(chat_id, [0, []])
+        entry[0] += 1
+        if len(entry[1]) < self.MAX_HELD_SUBJECTS:
+            entry[1].append(subject)
+    
+    def take_held(self):
+        """Retorna ``{chat_id: [quantidade, assuntos]}`` e esvazia os retidos"""
+        held = self.held
+        self.held, self.held_count = {}, 0
+        return held
+
+class SenderThrottle:
+    """Limite de emails por remetente em uma janela deslizante
+    
+    Até ``max_messages`` emails de um remetente são encaminhados a cada
+    ``window_minutes``; os seguintes são retidos e, quando a janela fecha,
+    viram uma única mensagem de resumo com os assuntos. Regras em ``rules``
+    definem limites próprios por padrão de remetente (mesma sintaxe de
+    ``from_addresses``; vale a primeira regra que casar). Os remetentes
+    ficam em ordem de uso e os ociosos mais antigos são descartados acima
+    de ``max_senders``.
+    """
+    
+    def __init__(self, default_limit, rules=(), max_senders=1000, parameters=None):
+        self.default_limit = default_limit
+        self.limits = SenderIndex()
+        for patterns, limit in rules:
+            for pattern in patterns:
+                self.limits.add(pattern, limit)
+        self.max_senders = max_senders
+        self.parameters = parameters
+        self.windows = OrderedDict()
+    
+    @staticmethod
+    def parse_limit(options, where, default=None):
+        """Lê (max_messages, janela em segundos) de um objeto de configuração"""
+        default = default or (10, 600)
+        max_messages = options.get('max_messages', default[0])
+        window_minutes = options.get('window_minutes', default[1] / 60)
+        if isinstance(max_messages, bool) or not isinstance(max_messages, int) or max_messages <= 0:
+            raise ValueError(f"{where}.max_messages deve ser um inteiro positivo")
+        if isinstance(window_minutes, bool) or not isinstance(window_minutes, (int, float)) or window_minutes <= 0:
+            raise ValueError(f"{where}.window_minutes deve ser um número positivo")
+        return (max_messages, window_minutes * 60)
+    
+    @classmethod
+    def from_settings(cls, options):
+        """Cria o limitador a partir de ``settings.throttle`` (None se desativado)
+        
+        Raises:
+            ValueError: se algum parâmetro for inválido
+        """
+        if options is None or options is False:
+            return None
+        if options is True:
+            options = {}
+        if not isinstance(options, dict):
+            raise ValueError("settings.throttle deve ser true/false ou um objeto")
+        if not options.get('enabled', True):
+            return None
+        
+        default_limit = cls.parse_limit(options, 'settings.throttle')
+        max_senders = options.get('max_senders', 1000)
+        if isinstance(max_senders, bool) or not isinstance(max_senders, int) or max_senders <= 0:
+            raise ValueError("settings.throttle.max_senders deve ser um inteiro positivo")
+        
+        rules = options.get('rules', [])
+        if not isinstance(rules, list):
+            raise ValueError("settings.throttle.rules deve ser uma lista")
+        compiled = []
+        for index, rule in enumerate(rules):
+            where = f"settings.throttle.rules[{index}]"
+            if not isinstance(rule, dict):
+                raise ValueError(f"{where} deve ser um objeto")
+            patterns = rule.get('from', [])
+            if not isinstance(patterns, list) or not patterns or not all(isinstance(item, str) for item in patterns):
+                raise ValueError(f"{where}.from deve ser uma lista de remetentes")
+            compiled.append((patterns, cls.parse_limit(rule, where, default_limit)))
+        
+        return cls(default_limit, compiled, max_senders,
+                   parameters=json.dumps(options, sort_keys=True))
+    
+    def limit_for(self, address, sender=''):
+        limits = self.limits.lookup(address, sender)
+        return limits[0] if limits else self.default_limit
+    
+    def allow(self, address, sender, chat_id, subject, now=None):
+        """Registra um email e diz se ele pode ser encaminhado agora
+        
+        Returns:
+            bool: False se o remetente excedeu o limite (o email fica retido
+            para o resumo)
+        """
+        if now is None:
+            now = time.time()
+        
+        window = self.windows.get(address)
+        if window is None:
+            window = SenderWindow(self.limit_for(address, sender), sender)
+            self.windows[address] = window
+            self.evict()
+        else:
+            self.windows.move_to_end(address)
+        
+        # Com emails retidos, os seguintes entram no mesmo resumo
+        if window.held_count == 0 and window.has_room(now):
+            window.sent.append(now)
+            return True
+        
+        window.hold(chat_id, subject)
+        return False
+    
+    def adopt(self, previous):
+        """Herda envios recentes e emails retidos de um limitador substituído
+        
+        Cada remetente passa a usar o limite da nova configuração.
+        """
+        for address, window in previous.windows.items():
+            window.limit = self.limit_for(address, window.sender)
+            self.windows[address] = window
+        self.evict()
+    
+    def evict(self):
+        """Descarta os remetentes ociosos mais antigos acima de ``max_senders``"""
+        excess = len(self.windows) - self.max_senders
+        if excess <= 0:
+            return
+        idle = []
+        for address, window in self.windows.items():
+            if len(idle) >= excess:
+                break
+            if not window.held_count:
+                idle.append(address)
+        for address in idle:
+            del self.windows[address]
+    
+    def due_summaries(self, now=None, flush=False):
+        """Retorna resumos dos remetentes cuja janela voltou a permitir envios
+        
+        Args:
+            flush: inclui todos os remetentes com emails retidos, mesmo com a
+                janela ainda cheia (limitador sendo desativado)
+        
+        Returns:
+            list: tuplas (remetente, {chat_id: [quantidade, assuntos]})
+        """
+        if now is None:
+            now = time.time()
+        summaries = []
+        for address, window in self.windows.items():
+            if window.held_count and (flush or window.has_room(now)):
+                summaries.append((address, window.take_held()))
+                # O resumo ocupa um envio da janela
+                window.sent.append(now)
+        return summaries
+    
+    def __len__(self):
+        return len(self.windows)
+
+def priority_features(record):
+    """Atributos de prioridade de um email: remetente, domínio, palavras do assunto e marcadores
+    
+    Só usa cabeçalhos e marcadores do Gmail (sem decodificar o corpo).
+    Sempre inclui remetente e domínio, então nenhum email fica sem atributos.
+    """
+    address = record.sender_address
+    features = [f"sender:{address}", f"domain:{address.rpartition('@')[2]}"]
+    subject = DIGITS.sub('0', normalize_text(record.subject))
+    features.extend(f"subject:{word}" for word in sorted(set(WORD.findall(subject))))
+    features.extend(f"label:{label}" for label in record.labels)
+    return features
+
+class PriorityScorer:
+    """Pontuação de prioridade com atributos em hashing (feature hashing)
+    
+    Cada atributo (ver ``priority_features``) é mapeado por crc32 para uma
+    posição de um vetor de pesos de tamanho fixo; a pontuação de um email é
+    a soma dos pesos dos seus atributos. Com NumPy, o lote inteiro é
+    pontuado em uma operação vetorizada (produto esparso lote × pesos via
+    ``numpy.add.reduceat``); sem NumPy, a soma é feita em Python puro.
+    """
+    
+    DEFAULT_DIMENSIONS = 2 ** 16
+    
+    # Índices de atributos já calculados (domínios e palavras se repetem muito)
+    MAX_CACHED_FEATURES = 100000
+    
+    def __init__(self, weights, bias=0.0, dimensions=DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.bias = bias
+        self.index_cache = {}
+        vector = [0.0] * dimensions
+        for feature, weight in weights.items():
+            vector[self.feature_index(feature)] += weight
+        self.weights = numpy.asarray(vector, dtype=numpy.float64) if numpy is not None else vector
+    
+    @classmethod
+    def from_settings(cls, options):
+        """Cria o pontuador a partir de ``settings.priority`` (None se desativado)
+        
+        Pesos vêm de ``weights`` ({"domain:empresa.com": 3, ...}) e/ou de
+        ``weights_file``, gerado por ``replay.py --fit-priority``; pesos
+        explícitos somam-se aos do arquivo.
+        
+        Raises:
+            ValueError: se a configuração ou o arquivo de pesos forem inválidos
+        """
+        if options is None or options is False:
+            return None
+        if not isinstance(options, dict):
+            raise ValueError("settings.priority deve ser false ou um objeto")
+        if not options.get('enabled', True):
+            return None
+        
+        weights = {}
+        bias = 0.0
+        weights_file = options.get('weights_file')
+        if weights_file:
+            try:
+                with open(weights_file, 'r', encoding='utf-8') as f:
+                    fitted = json.load(f)
+            except (OSError, ValueError) as e:
+                raise ValueError(f"settings.priority.weights_file: não foi possível ler {weights_file}: {e}")
+            if not isinstance(fitted, dict) or not isinstance(fitted.get('weights'), dict):
+                raise ValueError(f"settings.priority.weights_file: {weights_file} não tem 'weights'")
+            weights.update(fitted['weights'])
+            bias = fitted.get('bias', 0.0)
+        
+        explicit = options.get('weights', {})
+        if not isinstance(explicit, dict):
+            raise ValueError("settings.priority.weights deve ser um objeto {atributo: peso}")
+        for feature, weight in chain(weights.items(), explicit.items(), [('bias', bias)]):
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+                raise ValueError(f"settings.priority: peso de '{feature}' deve ser um número")
+        for feature, weight in explicit.items():
+            weights[feature] = weights.get(feature, 0.0) + weight
+        
+        if not weights:
+            raise ValueError("settings.priority precisa de 'weights' ou 'weights_file'")
+        
+        dimensions = options.get('dimensions', cls.DEFAULT_DIMENSIONS)
+        if isinstance(dimensions, bool) or not isinstance(dimensions, int) or dimensions < 1024:
+            raise ValueError("settings.priority.dimensions deve ser um inteiro >= 1024")
+        
+        return cls(weights, bias, dimensions)
+    
+    def feature_index(self, feature):
+        return zlib.crc32(feature.encode('utf-8')) % self.dimensions
+    
+    def score_batch(self, records):
+        """Pontua um lote de registros; retorna uma lista de pontuações"""
+        if not records:
+            return []
+        
+        cache = self.index_cache
+        if len(cache) > self.MAX_CACHED_FEATURES:
+            cache.clear()
+        indices = []
+        counts = []
+        for record in records:
+            features = priority_features(record)
+            for feature in features:
+                index = cache.get(feature)
+                if index is None:
+                    index = cache[feature] = self.feature_index(feature)
+                indices.append(index)
+            counts.append(len(features))
+        
+        if numpy is None:
+            weights = self.weights
+            scores = []
+            start = 0
+            for count in counts:
+                scores.append(self.bias + sum(weights[index] for index in indices[start:start + count]))
+                start += count
+            return scores
+        
+        # Linhas esparsas (índices + início de cada email) somadas de uma vez
+        offsets = numpy.zeros(len(counts), dtype=numpy.int64)
+        numpy.cumsum(counts[:-1], out=offsets[1:])
+        gathered = self.weights[numpy.asarray(indices, dtype=numpy.int64)]
+        return (numpy.add.reduceat(gathered, offsets) + self.bias).tolist()
+    
+    def order(self, items, key=lambda item: item):
+        """Ordena itens pela pontuação (maior primeiro), mantendo a ordem original nos empates
+        
+        Returns:
+            tuple: (itens ordenados, pontuações na nova ordem)
+        """
+        items = list(items)
+        scores = self.score_batch([key(item) for item in items])
+        ranked = sorted(range(len(items)), key=lambda position: -scores[position])
+        return [items[position] for position in ranked], [scores[position] for position in ranked]
+
+class ConfigWatcher:
+    """Observa o config.json e compila novas versões em segundo plano
+    
+    A mudança é detectada pelo mtime/tamanho do arquivo (sem dependências
+    extras). A nova versão é carregada e validada em uma thread; o forwarder
+    a aplica entre ciclos com ``take()``. Versões inválidas são registradas
+    e a configuração anterior continua valendo.
+    """
+    
+    def __init__(self, path, compile_function, poll_seconds=2):
+        self.path = path
+        self.compile_function = compile_function
+        self.poll_seconds = poll_seconds
+        self.signature = self.read_signature()
+        self.pending = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def read_signature(self):
+        """Retorna (mtime, tamanho) do arquivo ou None se inacessível"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def start(self):
+        """Inicia a thread de observação"""
+        self.thread = threading.Thread(target=self.watch, name='config-watcher', daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Encerra a thread de observação"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.poll_seconds + 1)
+            self.thread = None
+    
+    def watch(self):
+        while not self.stop_event.wait(self.poll_seconds):
+            self.check()
+    
+    def check(self):
+        """Compila o arquivo se ele mudou desde a última verificação"""
+        signature = self.read_signature()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            runtime = self.compile_function(config)
+        except Exception as e:
+            logging.error(f"Nova versão de {self.path} inválida, mantendo a configuração atual: {e}")
+            return False
+        
+        with self.lock:
+            self.pending = runtime
+        logging.info(f"Nova versão de {self.path} validada; será aplicada no próximo ciclo")
+        return True
+    
+    def take(self):
+        """Retorna a configuração compilada pendente (ou None) e a consome"""
+        with self.lock:
+            runtime, self.pending = self.pending, None
+        return runtime
+
+# Caracteres que precisam ser escapados no MarkdownV2 do Telegram, com o
+# escape pré-calculado. Um str.replace por caractere presente é mais rápido
+# que str.translate ou re.sub, que expandem 1 -> 2 caracteres em Python
+# (ver ``python benchmark.py escape``). A barra invertida vem primeiro: sem
+# escape ela consumiria o caractere seguinte
+MARKDOWN_SPECIAL_CHARS = '_*`[]()~>#+-=|{}.!'
+MARKDOWN_ESCAPES = (('\\', '\\\\'),) + tuple((char, '\\' + char) for char in MARKDOWN_SPECIAL_CHARS)
+
+# Entidades do modo HTML do Telegram: só &, < e > precisam ser escapados
+HTML_ESCAPES = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'))
+HTML_TAG = re.compile(r'<[^>]*>')
+
+# Gramática do MarkdownV2 (https://core.telegram.org/bots/api#markdownv2-style):
+# só os caracteres abaixo (e quebras de linha) mudam o estado da análise
+MARKDOWN_TOKEN = re.compile(r'[\\_*\[\]()~`>#+\-=|{}.!\n]')
+MARKDOWN_LINK_URL = re.compile(r'\((?:[^\\)]|\\.)*\)', re.DOTALL)
+MARKDOWN_PRE_LANGUAGE = re.compile(r'[A-Za-z0-9_+-]*\n')
+MARKDOWN_CODE = ('`', '```')
+
+# Tags e entidades aceitas pelo modo HTML do Telegram
+HTML_TOKEN = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9-]*)(?:\s[^<>]*)?>'
+                        r'|&(?:lt|gt|amp|quot|#\d+|#x[0-9A-Fa-f]+);|[<>&]')
+HTML_TAGS = frozenset(('b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'span',
+                       'tg-spoiler', 'a', 'code', 'pre', 'blockquote', 'tg-emoji'))
+
+def scan_markdown(text):
+    """Analisa ``text`` segundo a gramática do MarkdownV2 do Telegram
+
+    Returns:
+        tuple: (posições que o Telegram rejeitaria, texto sem a marcação).
+        As posições são caracteres reservados sem escape, barras soltas e
+        marcadores de entidade sem par ou fora de ordem; escapar cada um
+        torna essa parte do texto literal.
+    """
+    errors = []
+    plain = []
+    stack = []
+    position = 0
+    length = len(text)
+
+    while True:
+        match = MARKDOWN_TOKEN.search(text, position)
+        if match is None:
+            plain.append(text[position:])
+            break
+
+        start = match.start()
+        plain.append(text[position:start])
+        char = text[start]
+        position = start + 1
+        code = stack[-1][0] if stack and stack[-1][0] in MARKDOWN_CODE else None
+
+        if char == '\\':
+            # Qualquer caractere de código 1 a 126 pode ser escapado
+            if position < length and 0 < ord(text[position]) < 127:
+                plain.append(text[position])
+                position += 1
+            else:
+                errors.append(start)
+                plain.append(char)
+        elif code is not None:
+            # Dentro de código só ` e \ são especiais
+            if char != '`':
+                plain.append(char)
+            elif code == '`' or text.startswith('```', start):
+                stack.pop()
+                position = start + len(code)
+            else:
+                errors.append(start)
+                plain.append(char)
+        elif char == '\n':
+            plain.append(char)
+        elif char == '`':
+            if text.startswith('```', start):
+                stack.append(('```', start))
+                # Linguagem opcional na primeira linha (```python)
+                language = MARKDOWN_PRE_LANGUAGE.match(text, start + 3)
+                position = language.end() if language else start + 3
+            else:
+                stack.append(('`', start))
+        elif char in '*_~' or (char == '|' and text.startswith('||', start)):
+            marker = char
+            if char == '|':
+                marker = '||'
+            elif char == '_' and text.startswith('__', start) and not (stack and stack[-1][0] == '_'):
+                marker = '__'
+
+            if stack and stack[-1][0] == marker:
+                stack.pop()
+                position = start + len(marker)
+            elif any(opened == marker for opened, _ in stack):
+                # Fecha uma entidade que não é a mais interna
+                position = start + len(marker)
+                errors.extend(range(start, position))
+                plain.append(marker)
+            else:
+                stack.append((marker, start))
+                position = start + len(marker)
+        elif char == '[':
+            stack.append(('[', start))
+        elif char == ']' and stack and stack[-1][0] == '[':
+            url = MARKDOWN_LINK_URL.match(text, position)
+            if url is None:
+                errors.append(start)
+                plain.append(char)
+            else:
+                stack.pop()
+                position = url.end()
+        elif char == '>' and (start == 0 or text[start - 1] == '\n'):
+            pass  # citação no início da linha
+        else:
+            errors.append(start)
+            plain.append(char)
+
+    # Entidades abertas e nunca fechadas (todos os caracteres do marcador)
+    for marker, start in stack:
+        errors.extend(range(start, start + len(marker)))
+    errors.sort()
+    return errors, ''.join(plain)
+
+def insert_escapes(text, positions):
+    """Insere uma barra invertida antes de cada posição (em ordem crescente)"""
+    pieces = []
+    last = 0
+    for position in positions:
+        pieces.append(text[last:position])
+        pieces.append('\\')
+        last = position
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+def repair_markdown(text, attempts=3):
+    """Escapa o que o Telegram rejeitaria; None se o texto não ficar válido
+
+    Escapar um marcador sem par pode expor caracteres que antes estavam dentro
+    da entidade (ex.: código nunca fechado), por isso a análise é repetida.
+    """
+    for _ in range(attempts):
+        errors, _ = scan_markdown(text)
+        if not errors:
+            return text
+        text = insert_escapes(text, errors)
+    return None if scan_markdown(text)[0] else text
+
+class MarkdownRenderer:
+    """Saída em MarkdownV2 (parse_mode do Telegram)"""
+    parse_mode = 'MarkdownV2'
+    
+    def escape(self, text):
+        """Escapa os caracteres especiais do MarkdownV2"""
+        if not text:
+            return ""
+        
+        for char, escaped in MARKDOWN_ESCAPES:
+            if char in text:
+                text = text.replace(char, escaped)
+        return text
+    
+    def bold(self, text):
+        """Negrito (``text`` já escapado)"""
+        return f"*{text}*"
+    
+    def plain(self, message):
+        """Texto simples (sem marcação e sem escapes)"""
+        return scan_markdown(message)[1]
+
+    def prepare(self, message):
+        """Valida a mensagem antes do envio
+
+        Returns:
+            tuple: (texto, parse_mode); parse_mode é None quando a mensagem
+            não pôde ser corrigida e vai como texto simples.
+        """
+        errors, plain = scan_markdown(message)
+        if not errors:
+            return message, self.parse_mode
+
+        repaired = repair_markdown(insert_escapes(message, errors))
+        if repaired is not None:
+            logging.info(f"MarkdownV2 corrigido localmente ({len(errors)} caracteres escapados)")
+            return repaired, self.parse_mode
+
+        logging.warning("MarkdownV2 inválido; mensagem enviada como texto simples")
+        return plain, None
+
+class HtmlRenderer:
+    """Saída em HTML (parse_mode do Telegram)
+    
+    Escapa só &, < e >: o texto do email quase nunca contém esses caracteres,
+    então o escape costuma ser uma verificação de presença, e pontuação comum
+    (. - ! ( ) _) não pode quebrar a mensagem como no MarkdownV2.
+    """
+    parse_mode = 'HTML'
+    
+    def escape(self, text):
+        """Escapa &, < e >"""
+        if not text:
+            return ""
+        
+        for char, escaped in HTML_ESCAPES:
+            if char in text:
+                text = text.replace(char, escaped)
+        return text
+    
+    def bold(self, text):
+        """Negrito (``text`` já escapado)"""
+        return f"<b>{text}</b>"
+    
+    def plain(self, message):
+        """Texto simples (sem tags e sem entidades)"""
+        return html.unescape(HTML_TAG.sub('', message))
+
+    def prepare(self, message):
+        """Valida a mensagem antes do envio
+
+        &, < e > soltos são escapados; tags desconhecidas ou desbalanceadas
+        fazem a mensagem ir como texto simples.
+
+        Returns:
+            tuple: (texto, parse_mode); parse_mode é None para texto simples.
+        """
+        loose = []
+        stack = []
+        for match in HTML_TOKEN.finditer(message):
+            name = match.group(2)
+            if name is None:
+                if len(match.group()) == 1:
+                    loose.append(match)
+                continue
+
+            name = name.lower()
+            if name not in HTML_TAGS:
+                break
+            if not match.group(1):
+                stack.append(name)
+            elif not stack or stack.pop() != name:
+                break
+        else:
+            if not stack:
+                if not loose:
+                    return message, self.parse_mode
+                logging.info(f"HTML corrigido localmente ({len(loose)} caracteres escapados)")
+                pieces = []
+                last = 0
+                for match in loose:
+                    pieces.append(message[last:match.start()])
+                    pieces.append(self.escape(match.group()))
+                    last = match.end()
+                pieces.append(message[last:])
+                return ''.join(pieces), self.parse_mode
+
+        logging.warning("HTML inválido; mensagem enviada como texto simples")
+        return self.plain(message), None
+
+RENDERERS = {renderer.parse_mode: renderer for renderer in (MarkdownRenderer(), HtmlRenderer())}
+
+def get_renderer(parse_mode, where):
+    """Retorna o renderizador do ``parse_mode`` ('MarkdownV2' ou 'HTML')"""
+    renderer = RENDERERS.get(parse_mode)
+    if renderer is None:
+        raise ValueError(f"{where}: parse_mode inválido {parse_mode!r} (use {' ou '.join(RENDERERS)})")
+    return renderer
+
+class TelegramRateLimiter:
+    """Espaça os envios ao Telegram dentro dos limites da Bot API
+
+    Cerca de 1 mensagem por segundo em cada chat privado, 20 por minuto em
+    cada grupo (ids negativos) e 30 por segundo no total. Mensagens, partes
+    de emails divididos, anexos e resumos passam todos por aqui, na ordem de
+    envio. Um 429 (``retry_after``) bloqueia o chat pelo tempo pedido.
+    """
+    PRIVATE_INTERVAL = 1.0
+    GROUP_INTERVAL = 3.0
+    GLOBAL_INTERVAL = 1 / 30
+    MAX_CHATS = 1000
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.next_send = 0.0
+        # chat -> momento a partir do qual pode receber outra mensagem
+        self.next_chat_send = OrderedDict()
+
+    def wait(self, chat_id):
+        """Aguarda até que ``chat_id`` possa receber uma mensagem e reserva o envio"""
+        chat_id = str(chat_id)
+        now = self.clock()
+        ready = max(self.next_send, self.next_chat_send.get(chat_id, 0.0))
+        if ready > now:
+            self.sleep(ready - now)
+            now = ready
+
+        self.next_send = now + self.GLOBAL_INTERVAL
+        interval = self.GROUP_INTERVAL if chat_id.startswith('-') else self.PRIVATE_INTERVAL
+        self.next_chat_send[chat_id] = now + interval
+        self.next_chat_send.move_to_end(chat_id)
+        if len(self.next_chat_send) > self.MAX_CHATS:
+            self.next_chat_send.popitem(last=False)
+
+    def block(self, chat_id, seconds):
+        """Impede envios a ``chat_id`` pelos próximos ``seconds`` (resposta 429)"""
+        chat_id = str(chat_id)
+        until = self.clock() + seconds
+        self.next_chat_send[chat_id] = max(self.next_chat_send.get(chat_id, 0.0), until)
+        self.next_chat_send.move_to_end(chat_id)
+
 class GmailTelegramForwarder:
     def check_dependencies(self):
         """Verifica se todas as dependências estão instaladas"""
@@ -45,25 +3044,32 @@ class GmailTelegramForwarder:
         
         return len(missing_packages) == 0
     
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file='config.json', offline=False):
         """
         Inicializa o forwarder Gmail → Telegram
         
         Args:
             config_file (str): Caminho para arquivo de configuração
+            offline (bool): Não conecta ao Gmail (ex.: replay de um acervo local)
         """
         # Verifica dependências primeiro
         if not self.check_dependencies():
             raise ImportError("Dependências não instaladas corretamente!")
             
+        self.config_file = config_file
         self.config = self.load_config(config_file)
+        self.compile_config()
+        self.config_watcher = None
         self.gmail_service = None
+        self.parse_pool = None
+        self.rate_limiter = TelegramRateLimiter()
         self.last_check_time = datetime.now() - timedelta(hours=1)
         
         # Scopes necessários para Gmail API
         self.SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
         
-        self.setup_gmail()
+        if not offline:
+            self.setup_gmail()
         
     def load_config(self, config_file):
         """Carrega configurações do arquivo JSON"""
@@ -74,12 +3080,137 @@ class GmailTelegramForwarder:
         with open(config_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     
+    def compile_config(self):
+        """Prepara estruturas derivadas da configuração (compiladas uma única vez)"""
+        self.apply_runtime(self.build_runtime(self.config))
+    
+    def build_runtime(self, config):
+        """Valida e compila uma configuração sem alterar o forwarder
+        
+        Usado na inicialização e no recarregamento em segundo plano.
+        
+        Returns:
+            dict: Atributos a aplicar com ``apply_runtime``
+        
+        Raises:
+            ValueError: se a configuração for inválida
+        """
+        for section in ('telegram', 'gmail', 'filters', 'settings'):
+            if not isinstance(config.get(section), dict):
+                raise ValueError(f"Seção '{section}' ausente ou inválida")
+        settings = config['settings']
+        
+        interval = settings.get('check_interval_seconds')
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+            raise ValueError("settings.check_interval_seconds deve ser um número positivo")
+        
+        offload_kb = settings.get('parse_offload_kb', 256)
+        if isinstance(offload_kb, bool) or not isinstance(offload_kb, (int, float)) or offload_kb < 0:
+            raise ValueError("settings.parse_offload_kb deve ser um número positivo (0 desativa)")
+        parse_workers = settings.get('parse_workers', 2)
+        if isinstance(parse_workers, bool) or not isinstance(parse_workers, int) or parse_workers <= 0:
+            raise ValueError("settings.parse_workers deve ser um inteiro positivo")
+        
+        # Filtros validados e compilados (uma passada por email)
+        filter_set = FilterSet.compile(config['filters'])
+        
+        # Regras de roteamento indexadas por remetente
+        router = Router.compile(config)
+        
+        return {
+            'config': config,
+            'reply_trimmer': ReplyTrimmer.from_config(settings.get('trimming')),
+            'attachment_options': AttachmentOptions.from_settings(settings),
+            'filter_set': filter_set,
+            'router': router,
+            
+            # Cabeçalhos de rastreamento citados por regras não são descartados
+            'header_skip': TRACE_HEADERS - filter_set.header_names - router.header_names,
+            
+            # Emails grandes são processados em outro processo (0 desativa)
+            'parse_offload_bytes': int(offload_kb * 1024),
+            'parse_workers': parse_workers,
+            
+            # Supressão de emails quase idênticos (None desativa)
+            'duplicate_index': DuplicateIndex.from_settings(settings.get('deduplicate')),
+            
+            # Limite de emails por remetente (None desativa)
+            'sender_throttle': SenderThrottle.from_settings(settings.get('throttle')),
+            
+            # Ordem de envio por prioridade (None mantém a ordem do Gmail)
+            'priority_scorer': PriorityScorer.from_settings(settings.get('priority')),
+            
+            # Corpos longos divididos em até N mensagens (1 corta com "...")
+            'max_message_parts': self.parse_split_settings(settings.get('split_messages')),
+        }
+    
+    @staticmethod
+    def parse_split_settings(split):
+        """Valida ``settings.split_messages`` e retorna o máximo de mensagens por email"""
+        if split is None:
+            return 1
+        if not isinstance(split, dict):
+            raise ValueError("settings.split_messages deve ser um objeto")
+        if not split.get('enabled', False):
+            return 1
+        
+        max_parts = split.get('max_parts', 4)
+        if isinstance(max_parts, bool) or not isinstance(max_parts, int) or not 1 <= max_parts <= 20:
+            raise ValueError("settings.split_messages.max_parts deve ser um inteiro de 1 a 20")
+        return max_parts
+    
+    def apply_runtime(self, runtime):
+        """Aplica de uma vez uma configuração compilada por ``build_runtime``"""
+        for warning in runtime['filter_set'].warnings:
+            logging.warning(f"Configuração de filtros: {warning}")
+        
+        # Histórico de deduplicação e janelas de envio sobrevivem ao recarregamento:
+        # mantidos se os parâmetros não mudaram, migrados se mudaram e, se o
+        # recurso foi desativado, os contadores e retidos pendentes são enviados
+        for name in ('duplicate_index', 'sender_throttle'):
+            current = self.__dict__.get(name)
+            candidate = runtime[name]
+            if current is None:
+                continue
+            if candidate is None:
+                if name == 'duplicate_index':
+                    self.send_duplicate_summaries()
+                else:
+                    self.send_throttle_summaries(flush=True)
+            elif current.parameters == candidate.parameters:
+                runtime = dict(runtime, **{name: current})
+            else:
+                candidate.adopt(current)
+        
+        self.__dict__.update(runtime)
+    
+    def apply_config_update(self):
+        """Troca a configuração se uma nova versão válida foi compilada (entre ciclos)"""
+        if self.config_watcher is None:
+            return
+        
+        runtime = self.config_watcher.take()
+        if runtime is None:
+            return
+        
+        if runtime['config']['gmail'] != self.config['gmail']:
+            logging.warning("Alterações na seção 'gmail' só valem após reiniciar o forwarder")
+        
+        # O pool de parsing é recriado no próximo uso com o novo tamanho
+        if self.parse_pool is not None and runtime['parse_workers'] != self.parse_workers:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+        
+        self.apply_runtime(runtime)
+        logging.info(f"Configuração recarregada de {self.config_file}")
+    
     def create_sample_config(self, config_file):
         """Cria arquivo de configuração de exemplo"""
         sample_config = {
             "telegram": {
                 "bot_token": "SEU_BOT_TOKEN_AQUI",
-                "chat_id": "SEU_CHAT_ID_AQUI"
+                "chat_id": "SEU_CHAT_ID_AQUI",
+                "parse_mode": "HTML"
             },
             "gmail": {
                 "credentials_file": "credentials.json",
@@ -90,13 +3221,53 @@ class GmailTelegramForwarder:
                 "subject_keywords": [],
                 "body_keywords": [],
                 "exclude_keywords": ["noreply", "no-reply"],
+                "headers": [],
                 "max_age_hours": 24
             },
+            "routes": [],
             "settings": {
                 "check_interval_seconds": 300,
                 "include_attachments": True,
+                "skip_inline_images": True,
+                "min_image_size_kb": 100,
+                "attachment_rules": [
+                    {"action": "skip", "extensions": [".ics"], "mime_types": ["image/gif"]}
+                ],
+                "attachment_default": "forward",
+                "parse_offload_kb": 256,
+                "parse_workers": 2,
+                "reload_config": True,
+                "deduplicate": {
+                    "enabled": False,
+                    "max_distance": 6,
+                    "window_minutes": 60,
+                    "max_entries": 5000
+                },
+                "priority": {
+                    "enabled": False,
+                    "weights": {"label:IMPORTANT": 2},
+                    "weights_file": ""
+                },
+                "split_messages": {
+                    "enabled": False,
+                    "max_parts": 4
+                },
+                "throttle": {
+                    "enabled": False,
+                    "max_messages": 10,
+                    "window_minutes": 10,
+                    "max_senders": 1000,
+                    "rules": []
+                },
                 "max_message_length": 4000,
-                "send_full_email": True
+                "send_full_email": True,
+                "trimming": {
+                    "enabled": False,
+                    "quoted_lines": True,
+                    "reply_headers": True,
+                    "outlook_separators": True,
+                    "signatures": True
+                }
             }
         }
         
@@ -145,25 +3316,29 @@ class GmailTelegramForwarder:
             # Constrói query de busca
             query_parts = [f'after:{after_timestamp}']
             
-            # Adiciona filtros de remetente
-            from_addresses = self.config['filters'].get('from_addresses', [])
-            if from_addresses:
-                from_query = ' OR '.join([f'from:{addr}' for addr in from_addresses])
-                query_parts.append(f'({from_query})')
+            # Adiciona filtros de remetente (agrupados se a lista for grande)
+            if self.filter_set.sender_clause:
+                query_parts.append(self.filter_set.sender_clause)
             
             # Adiciona filtros de assunto
-            subject_keywords = self.config['filters'].get('subject_keywords', [])
+            subject_keywords = self.filter_set.subject_keywords
             if subject_keywords:
                 subject_query = ' OR '.join([f'subject:{kw}' for kw in subject_keywords])
                 query_parts.append(f'({subject_query})')
             
             query = ' '.join(query_parts) if len(query_parts) > 1 else query_parts[0]
             
-            # Busca emails
-            results = self.gmail_service.users().messages().list(
-                userId='me', q=query).execute()
+            # Busca emails (todas as páginas: após uma queda a fila passa de 100)
+            messages = []
+            page_token = None
+            while True:
+                results = self.gmail_service.users().messages().list(
+                    userId='me', q=query, pageToken=page_token).execute()
+                messages.extend(results.get('messages', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
             
-            messages = results.get('messages', [])
             logging.info(f"Encontrados {len(messages)} novos emails")
             
             return messages
@@ -172,208 +3347,413 @@ class GmailTelegramForwarder:
             logging.error(f"Erro ao buscar emails: {e}")
             return []
     
-    def get_email_details(self, message_id):
-        """Obtém detalhes completos de um email"""
+    def get_email_metadata(self, message_id):
+        """Obtém só os cabeçalhos de um email (sem corpo nem anexos)"""
         try:
             message = self.gmail_service.users().messages().get(
-                userId='me', id=message_id, format='full').execute()
+                userId='me', id=message_id, format='metadata').execute()
+            return EmailRecord.from_message(message, self.attachment_options, self.header_skip)
+        except Exception as e:
+            logging.error(f"Erro ao obter cabeçalhos do email {message_id}: {e}")
+            return None
+    
+    def prefilter_by_headers(self, messages, metadata):
+        """Fase de metadados: aplica as verificações que só leem cabeçalhos
+        
+        Emails descartados aqui (ex.: listas e envios em massa) não têm o
+        corpo baixado nem decodificado.
+        
+        Args:
+            messages (list): Mensagens retornadas pela busca
+            metadata (dict): Registros só com cabeçalhos, por id
+        
+        Returns:
+            tuple: (mensagens que seguem, ids já verificados nesta fase)
+        """
+        remaining = []
+        checked = set()
+        for message in messages:
+            record = metadata.get(message['id'])
+            if record is None:
+                # Sem cabeçalhos, todas as verificações rodam depois no email completo
+                remaining.append(message)
+                continue
             
-            headers = message['payload'].get('headers', [])
-            
-            # Extrai informações do cabeçalho
-            email_data = {
-                'id': message_id,
-                'subject': self.get_header_value(headers, 'Subject'),
-                'from': self.get_header_value(headers, 'From'),
-                'to': self.get_header_value(headers, 'To'),
-                'date': self.get_header_value(headers, 'Date'),
-                'body': '',
-                'attachments': []
-            }
+            decision = self.filter_set.evaluate(record, 'metadata')
+            if not decision.forward:
+                logging.info(f"Email não encaminhado ({decision.reason}), corpo não baixado")
+                continue
+            remaining.append(message)
+            checked.add(message['id'])
+        return remaining, checked
+    
+    def order_by_priority(self, messages, metadata):
+        """Ordena as mensagens pela pontuação dos cabeçalhos, antes do download completo
+        
+        Emails sem metadados (falha ao obter os cabeçalhos) são pontuados
+        como um registro vazio.
+        """
+        records = [metadata.get(message['id']) or EmailRecord(message['id'], ()) for message in messages]
+        ranked, scores = self.priority_scorer.order(zip(messages, records), key=lambda item: item[1])
+        logging.info(f"{len(ranked)} emails ordenados por prioridade "
+                     f"(pontuações de {scores[-1]:.2f} a {scores[0]:.2f})")
+        return [message for message, record in ranked]
+    
+    def get_email_details(self, message_id, offload=True):
+        """Obtém detalhes completos de um email
+        
+        Args:
+            message_id: ID da mensagem no Gmail
+            offload: se False, nunca envia o parsing para o pool
+        """
+        try:
+            message = self.gmail_service.users().messages().get(
+                userId='me', id=message_id, format='full').execute()
             
-            # Extrai corpo do email
-            email_data['body'] = self.extract_email_body(message['payload'])
+            # Corpo e anexos só são extraídos quando forem usados
+            record = EmailRecord.from_message(message, self.attachment_options, self.header_skip)
             
-            # Extrai anexos se configurado
-            if self.config['settings'].get('include_attachments', True):
-                email_data['attachments'] = self.extract_attachments(message)
+            # Emails com muito texto são processados em paralelo enquanto os
+            # próximos são baixados (anexos não pesam no parsing)
+            if (offload and self.parse_offload_bytes and
+                    text_parts_size(message.get('payload', {})) >= self.parse_offload_bytes):
+                try:
+                    record.defer(self.get_parse_pool().submit(
+                        parse_message, message, self.attachment_options))
+                except Exception as e:
+                    logging.warning(f"Não foi possível enviar email {message_id} para o pool de parsing: {e}")
             
-            return email_data
+            return record
             
         except Exception as e:
             logging.error(f"Erro ao obter detalhes do email {message_id}: {e}")
             return None
     
+    def iter_email_details(self, messages):
+        """Baixa os emails em ordem, com leitura antecipada limitada
+        
+        Emails grandes são processados no pool enquanto os seguintes ainda
+        estão sendo baixados, mas só ``PARSE_READ_AHEAD_PER_WORKER`` emails por
+        processo ficam à frente do processamento: o restante não é baixado
+        antes da hora nem mantém payloads em memória. Os emails saem na ordem
+        da lista assim que o parsing deles terminou.
+        
+        Yields:
+            tuple: (mensagem, EmailRecord) dos emails obtidos com sucesso
+        """
+        read_ahead = PARSE_READ_AHEAD_PER_WORKER * self.parse_workers if self.parse_offload_bytes else 0
+        window = deque()
+        for message in messages:
+            record = self.get_email_details(message['id'])
+            if record is None:
+                continue
+            window.append((message, record))
+            # Entrega os já prontos; só espera o pool com a janela cheia
+            while window and (len(window) > read_ahead or window[0][1].parsed):
+                item = self.resolve_email_details(*window.popleft())
+                if item is not None:
+                    yield item
+        while window:
+            item = self.resolve_email_details(*window.popleft())
+            if item is not None:
+                yield item
+    
+    def resolve_email_details(self, message, record):
+        """Conclui o parsing de um email do pool, refazendo-o localmente se falhou
+        
+        Returns:
+            tuple: (mensagem, EmailRecord), ou None se o email não pôde ser obtido
+        """
+        if record.resolve():
+            return message, record
+        # O payload foi descartado ao ir para o pool: baixa de novo e processa aqui
+        logging.info(f"Processando email {message['id']} novamente na thread principal")
+        record = self.get_email_details(message['id'], offload=False)
+        if record is None:
+            return None
+        return message, record
+    
+    def get_parse_pool(self):
+        """Retorna o pool de processos de parsing (criado no primeiro uso)"""
+        if self.parse_pool is None:
+            self.parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self.parse_pool
+    
+    def close(self):
+        """Libera recursos (observador do config.json e pool de parsing)"""
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+            self.config_watcher = None
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+    
     def get_header_value(self, headers, name):
         """Extrai valor de um cabeçalho específico"""
-        for header in headers:
-            if header['name'] == name:
-                return header['value']
-        return ''
+        if not isinstance(headers, HeaderIndex):
+            headers = HeaderIndex(headers)
+        return headers.get(name)
     
     def extract_email_body(self, payload):
         """Extrai corpo do email de forma recursiva"""
-        body = ''
-        
-        if 'parts' in payload:
-            for part in payload['parts']:
-                body += self.extract_email_body(part)
-        else:
-            if payload['mimeType'] == 'text/plain':
-                data = payload['body'].get('data', '')
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-            elif payload['mimeType'] == 'text/html':
-                data = payload['body'].get('data', '')
-                if data:
-                    html_body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                    # Remove tags HTML básicas
-                    body = re.sub('<[^<]+?>', '', html_body)
-        
-        return body
+        return extract_body_from_payload(payload)
     
     def extract_attachments(self, message):
         """Extrai informações sobre anexos"""
-        attachments = []
+        return extract_attachments_from_payload(message['payload'])
+    
+    def should_forward_email(self, record):
+        """Verifica se o email deve ser encaminhado baseado nos filtros"""
+        decision = self.filter_set.evaluate(record)
+        if not decision.forward:
+            logging.info(f"Email não encaminhado ({decision.reason})")
+        return decision.forward
+    
+    def decide(self, record, now=None, phase=None):
+        """Passa o email por filtros, roteamento, deduplicação e limite por remetente
         
-        def process_parts(parts):
-            for part in parts:
-                if part.get('filename'):
-                    attachment = {
-                        'filename': part['filename'],
-                        'mimeType': part['mimeType'],
-                        'size': part['body'].get('size', 0),
-                        'attachmentId': part['body'].get('attachmentId')
-                    }
-                    attachments.append(attachment)
-                
-                if 'parts' in part:
-                    process_parts(part['parts'])
+        Não envia nada; usado pelo ciclo normal e pelo replay offline.
+        
+        Args:
+            record (EmailRecord): Email a avaliar
+            now (float): Momento do recebimento (padrão: agora)
+            phase (str): 'content' quando as verificações de cabeçalho já
+                rodaram na fase de metadados
+        
+        Returns:
+            Delivery: ação ('forward', 'filtered', 'duplicate' ou
+            'throttled'), motivo e rota escolhida
+        """
+        decision = self.filter_set.evaluate(record, phase)
+        if not decision.forward:
+            return Delivery('filtered', decision.reason, None)
+        
+        # Escolhe destino e template
+        route = self.router.route(record)
+        
+        fingerprint = None
+        if self.duplicate_index is not None:
+            fingerprint = simhash(normalize_text(record.subject) + ' ' + record.body_text)
+        
+        reason = self.check_duplicate(fingerprint, route, now)
+        if reason is not None:
+            return Delivery('duplicate', reason, route)
         
-        if 'parts' in message['payload']:
-            process_parts(message['payload']['parts'])
+        reason = self.check_throttle(record, route, now)
+        if reason is not None:
+            return Delivery('throttled', reason, route)
         
-        return attachments
+        return Delivery('forward', None, route, fingerprint)
     
-    def should_forward_email(self, email_data):
-        """Verifica se o email deve ser encaminhado baseado nos filtros"""
+    def check_duplicate(self, fingerprint, route, now=None):
+        """Retorna o motivo se um email quase idêntico já foi encaminhado ao mesmo chat"""
+        if self.duplicate_index is None:
+            return None
         
-        # Verifica palavras-chave de exclusão
-        exclude_keywords = self.config['filters'].get('exclude_keywords', [])
-        email_text = f"{email_data['subject']} {email_data['body']} {email_data['from']}".lower()
+        similar = self.duplicate_index.find(fingerprint, route.chat_id, now)
+        if similar is None:
+            return None
+        return f"semelhante a '{similar.label}'"
+    
+    def remember_forwarded(self, record, delivery, now=None):
+        """Registra no índice de duplicatas um email já enviado ao Telegram
         
-        for keyword in exclude_keywords:
-            if keyword.lower() in email_text:
-                logging.info(f"Email excluído por palavra-chave: {keyword}")
-                return False
+        Só emails efetivamente entregues viram referência: um envio com falha
+        ou um email retido pelo limite por remetente não suprime os seguintes.
+        """
+        if self.duplicate_index is None or delivery.fingerprint is None:
+            return
+        self.duplicate_index.add(delivery.fingerprint, delivery.route.chat_id, record.subject, now)
+    
+    def send_duplicate_summaries(self):
+        """Envia um contador "+N semelhantes" para cada email com repetições suprimidas"""
+        if self.duplicate_index is None:
+            return
         
-        # Verifica palavras-chave do corpo (se especificadas)
-        body_keywords = self.config['filters'].get('body_keywords', [])
-        if body_keywords:
-            found_keyword = False
-            for keyword in body_keywords:
-                if keyword.lower() in email_data['body'].lower():
-                    found_keyword = True
-                    break
-            if not found_keyword:
-                return False
+        for entry, count in self.duplicate_index.pending_reports():
+            noun = 'email semelhante' if count == 1 else 'emails semelhantes'
+            renderer = self.router.renderer_for(entry.scope)
+            message = f"🔁 {renderer.escape(f'+{count} {noun} a:')} {renderer.bold(renderer.escape(entry.label))}"
+            self.send_telegram_message(message, entry.scope, renderer)
+    
+    def check_throttle(self, record, route, now=None):
+        """Retorna o motivo se o remetente excedeu o limite de envios (o email fica retido)"""
+        if self.sender_throttle is None:
+            return None
         
-        return True
+        if self.sender_throttle.allow(record.sender_address, record.sender, route.chat_id, record.subject, now):
+            return None
+        return f"limite de envios de {record.sender_address} atingido, retido para resumo"
+    
+    def send_throttle_summaries(self, flush=False):
+        """Envia um resumo dos emails retidos de cada remetente cuja janela fechou
+        
+        Com ``flush``, envia os resumos de todos os retidos (ver ``apply_runtime``).
+        """
+        if self.sender_throttle is None:
+            return
+        
+        for address, held in self.sender_throttle.due_summaries(flush=flush):
+            for chat_id, (count, subjects) in held.items():
+                noun = 'email retido' if count == 1 else 'emails retidos'
+                renderer = self.router.renderer_for(chat_id)
+                escape = renderer.escape
+                lines = [f"⏸️ {escape(f'{count} {noun} de')} {renderer.bold(escape(address))}"]
+                lines.extend(f"• {escape(subject)}" for subject in subjects)
+                if count > len(subjects):
+                    lines.append(escape(f"… e mais {count - len(subjects)}"))
+                self.send_telegram_message('\n'.join(lines), chat_id, renderer)
+    
+    def log_filter_statistics(self):
+        """Registra custo e taxa de rejeição de cada verificação de filtro"""
+        statistics = [item for item in self.filter_set.statistics() if item['calls']]
+        if not statistics:
+            return
+        
+        summary = '; '.join(
+            f"{item['name']}: {item['calls']} avaliações, {item['reject_rate'] * 100:.0f}% rejeitados, "
+            f"{item['average_us']:.0f} µs"
+            for item in statistics)
+        logging.info(f"Filtros (ordem atual): {summary}")
     
     def escape_markdown(self, text):
         """Escapa caracteres especiais do Markdown"""
-        if not text:
-            return ""
+        return RENDERERS['MarkdownV2'].escape(text)
+    
+    def format_telegram_message(self, record, route=None):
+        """Formata email para envio no Telegram em uma única mensagem
+        
+        Args:
+            record (EmailRecord): Email a formatar
+            route (Route): Rota escolhida (template, remoção de citações e
+                parse_mode próprios)
+        """
+        return self.format_telegram_messages(record, route, max_parts=1)[0]
+    
+    def format_telegram_messages(self, record, route=None, max_parts=None):
+        """Formata email para envio no Telegram, dividindo corpos longos
         
-        # Caracteres que precisam ser escapados no Markdown
-        special_chars = ['_', '*', '`', '[', ']', '(', ')', '~', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+        Args:
+            record (EmailRecord): Email a formatar
+            route (Route): Rota escolhida
+            max_parts (int): Máximo de mensagens (padrão: settings.split_messages)
         
-        for char in special_chars:
-            text = text.replace(char, f'\\{char}')
+        Returns:
+            list: Mensagens na ordem de envio
+        """
+        if max_parts is None:
+            max_parts = self.max_message_parts
+        max_length = min(self.config['settings'].get('max_message_length', 4000), TELEGRAM_MESSAGE_LIMIT)
+        if route is None:
+            route = self.router.default_route
+        template = route.template
         
-        return text
+        # Corpo do email
+        body = ''
+        if template.has_body and self.config['settings'].get('send_full_email', True):
+            body = record.body
+            
+            # Remove histórico citado e assinatura antes de escapar e cortar
+            reply_trimmer = self.reply_trimmer
+            if route.reply_trimmer is not None:
+                reply_trimmer = route.reply_trimmer
+            if reply_trimmer is not None:
+                body = reply_trimmer.trim(body)
+            
+            body = body.strip()
+        
+        return template.render(record, body, max_length, max_parts)
     
-    def format_telegram_message(self, email_data):
-        """Formata email para envio no Telegram"""
-        max_length = self.config['settings'].get('max_message_length', 4000)
+    def format_attachment_list(self, attachments, renderer=None):
+        """Formata a lista de anexos da mensagem"""
+        return render_attachment_list(attachments, renderer or RENDERERS['MarkdownV2'])[0]
+    
+    def post_telegram(self, url, chat_id, data, files=None, timeout=30):
+        """Faz uma requisição de envio à Bot API passando pelo limitador
+        
+        Um 429 bloqueia o chat pelo ``retry_after`` pedido pelo Telegram e a
+        requisição é repetida uma vez, depois da espera.
+        """
+        self.rate_limiter.wait(chat_id)
+        response = requests.post(url, data=data, files=files, timeout=timeout)
+        if response.status_code != 429:
+            return response
         
-        # Escapa dados para evitar problemas de formatação
-        from_safe = self.escape_markdown(email_data['from'])
-        subject_safe = self.escape_markdown(email_data['subject'])
-        date_safe = self.escape_markdown(email_data['date'])
+        try:
+            retry_after = float(response.json()['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            retry_after = 5.0
+        logging.warning(f"Limite de envios do Telegram atingido; aguardando {retry_after:.0f}s")
+        self.rate_limiter.block(chat_id, retry_after)
+        self.rate_limiter.wait(chat_id)
+        return requests.post(url, data=data, files=files, timeout=timeout)
+    
+    def send_telegram_message(self, message, chat_id=None, renderer=None, reply_to=None):
+        """Envia mensagem para o Telegram (chat padrão se ``chat_id`` não for informado)
         
-        # Cabeçalho do email
-        message = f"📧 *Novo Email*\n\n"
-        message += f"*De:* {from_safe}\n"
-        message += f"*Assunto:* {subject_safe}\n"
-        message += f"*Data:* {date_safe}\n\n"
+        ``renderer`` indica o parse_mode em que a mensagem foi formatada
+        (padrão: MarkdownV2). A mensagem é validada localmente antes do envio:
+        o que o Telegram rejeitaria é escapado ou, em último caso, a mensagem
+        vai como texto simples, sempre em uma única requisição.
         
-        # Corpo do email
-        if self.config['settings'].get('send_full_email', True):
-            body = email_data['body'].strip()
-            if len(body) > (max_length - len(message) - 200):
-                body = body[:max_length - len(message) - 200] + "..."
-            
-            # Escapa o corpo do email
-            body_safe = self.escape_markdown(body)
-            message += f"*Conteúdo:*\n{body_safe}\n\n"
-        
-        # Anexos
-        if email_data['attachments']:
-            message += f"📎 *Anexos \\({len(email_data['attachments'])}\\):*\n"
-            for att in email_data['attachments']:
-                size_mb = att['size'] / (1024 * 1024) if att['size'] > 0 else 0
-                filename_safe = self.escape_markdown(att['filename'])
-                message += f"• {filename_safe} \\({size_mb:.1f} MB\\)\n"
-        
-        return message[:max_length]
-    
-    def send_telegram_message(self, message):
-        """Envia mensagem para o Telegram"""
+        Args:
+            reply_to (int): Responde a esta mensagem (partes de um email dividido)
+        
+        Returns:
+            int: ``message_id`` da mensagem enviada, ou None se o envio falhou
+        """
+        renderer = renderer or RENDERERS['MarkdownV2']
         try:
             bot_token = self.config['telegram']['bot_token']
-            chat_id = self.config['telegram']['chat_id']
+            chat_id = chat_id or self.config['telegram']['chat_id']
             
             url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
             
+            text, parse_mode = renderer.prepare(message)
+            
+            # Mensagens montadas fora dos templates (ex.: resumos) também não
+            # podem passar do limite: o texto com marcação é uma cota superior
+            if utf16_length(text) > TELEGRAM_MESSAGE_LIMIT:
+                plain = renderer.plain(text) if parse_mode else text
+                if utf16_length(plain) > TELEGRAM_MESSAGE_LIMIT:
+                    logging.warning("Mensagem acima do limite do Telegram; enviada cortada, sem formatação")
+                    text, parse_mode = truncate_utf16(plain, TELEGRAM_MESSAGE_LIMIT), None
+            
             data = {
                 'chat_id': chat_id,
-                'text': message,
-                'parse_mode': 'MarkdownV2'
+                'text': text
             }
+            if parse_mode:
+                data['parse_mode'] = parse_mode
+            if reply_to is not None:
+                data['reply_to_message_id'] = reply_to
+                data['allow_sending_without_reply'] = True
             
-            response = requests.post(url, data=data, timeout=30)
+            response = self.post_telegram(url, chat_id, data)
             
             if response.status_code == 200:
                 logging.info("Mensagem enviada para Telegram com sucesso!")
-                return True
-            else:
-                # Se falhar com MarkdownV2, tenta sem formatação
-                logging.warning(f"Erro com Markdown: {response.text}")
-                logging.info("Tentando enviar sem formatação...")
-                
-                # Remove formatação e envia texto simples
-                simple_message = message.replace('*', '').replace('_', '').replace('`', '').replace('\\', '')
-                
-                data_simple = {
-                    'chat_id': chat_id,
-                    'text': simple_message
-                }
-                
-                response_simple = requests.post(url, data=data_simple, timeout=30)
-                
-                if response_simple.status_code == 200:
+                return response.json()['result']['message_id']
+            
+            if parse_mode and response.status_code == 400 and "can't parse entities" in response.text:
+                # Não deveria acontecer após a validação local: registra o
+                # caso e reenvia como texto simples para não perder o email
+                logging.warning(f"Erro com {parse_mode} não previsto pela validação: {response.text}")
+                del data['parse_mode']
+                data['text'] = renderer.plain(text)
+                response = self.post_telegram(url, chat_id, data)
+                if response.status_code == 200:
                     logging.info("Mensagem enviada sem formatação com sucesso!")
-                    return True
-                else:
-                    logging.error(f"Erro ao enviar para Telegram: {response_simple.status_code} - {response_simple.text}")
-                    return False
+                    return response.json()['result']['message_id']
+            
+            logging.error(f"Erro ao enviar para Telegram: {response.status_code} - {response.text}")
+            return None
                 
         except Exception as e:
             logging.error(f"Erro ao enviar mensagem para Telegram: {e}")
-            return False
+            return None
     
-    def send_attachment_to_telegram(self, attachment, message_id):
+    def send_attachment_to_telegram(self, attachment, message_id, chat_id=None):
         """Envia anexo para o Telegram (se possível)"""
         try:
             # Baixa anexo do Gmail
@@ -383,7 +3763,7 @@ class GmailTelegramForwarder:
             file_data = base64.urlsafe_b64decode(attachment_data['data'])
             
             bot_token = self.config['telegram']['bot_token']
-            chat_id = self.config['telegram']['chat_id']
+            chat_id = chat_id or self.config['telegram']['chat_id']
             
             # Decide o tipo de envio baseado no MIME type
             if attachment['mimeType'].startswith('image/'):
@@ -398,7 +3778,7 @@ class GmailTelegramForwarder:
             
             data = {'chat_id': chat_id}
             
-            response = requests.post(url, data=data, files=files, timeout=60)
+            response = self.post_telegram(url, chat_id, data, files=files, timeout=60)
             
             if response.status_code == 200:
                 logging.info(f"Anexo '{attachment['filename']}' enviado com sucesso!")
@@ -417,30 +3797,75 @@ class GmailTelegramForwarder:
         
         new_messages = self.get_new_emails()
         
-        for message in new_messages:
-            email_data = self.get_email_details(message['id'])
+        # Regras de cabeçalho e prioridade usam só os metadados: o email
+        # completo é baixado depois, já na ordem de envio
+        prioritize = self.priority_scorer is not None and len(new_messages) > 1
+        metadata = {}
+        if self.filter_set.metadata_phase or prioritize:
+            for message in new_messages:
+                record = self.get_email_metadata(message['id'])
+                if record is not None:
+                    metadata[message['id']] = record
+        
+        checked = set()
+        if self.filter_set.metadata_phase:
+            new_messages, checked = self.prefilter_by_headers(new_messages, metadata)
+        
+        # Com fila acumulada (ex.: após uma queda), os mais importantes saem primeiro
+        if prioritize and len(new_messages) > 1:
+            new_messages = self.order_by_priority(new_messages, metadata)
+        metadata = None
+        
+        for message, record in self.iter_email_details(new_messages):
             
-            if not email_data:
-                continue
+            delivery = self.decide(record, phase='content' if message['id'] in checked else None)
             
-            if not self.should_forward_email(email_data):
+            # Texto normalizado só é usado por filtros e roteamento
+            record.compact()
+            
+            if delivery.action != 'forward':
+                logging.info(f"Email não encaminhado ({delivery.reason})")
                 continue
             
-            # Formata e envia mensagem
-            telegram_message = self.format_telegram_message(email_data)
+            route = delivery.route
+            if route is not self.router.default_route:
+                logging.info(f"Email roteado pela regra '{route.name}'")
+            
+            if record.inline_attachments:
+                logging.info(f"{len(record.inline_attachments)} imagens embutidas no HTML ignoradas")
+            for attachment in record.skipped_attachments:
+                logging.info(f"Anexo '{attachment['filename']}' não encaminhado ({attachment['skipReason']})")
+            
+            # Formata e envia mensagem (todas as partes são montadas antes do
+            # primeiro envio; cada parte responde à anterior)
+            telegram_messages = self.format_telegram_messages(record, route)
+            if len(telegram_messages) > 1:
+                logging.info(f"Email dividido em {len(telegram_messages)} mensagens")
+            
+            reply_to = None
+            for telegram_message in telegram_messages:
+                reply_to = self.send_telegram_message(telegram_message, route.chat_id, route.renderer, reply_to)
+                if reply_to is None:
+                    break
             
-            if self.send_telegram_message(telegram_message):
+            if reply_to is not None:
+                self.remember_forwarded(record, delivery)
+                
                 # Envia anexos se configurado e existirem
                 if (self.config['settings'].get('include_attachments', True) and 
-                    email_data['attachments']):
+                    record.attachments):
                     
-                    for attachment in email_data['attachments']:
+                    for attachment in record.attachments:
                         # Limita tamanho do anexo (Telegram tem limite de 50MB)
                         if attachment['size'] < 50 * 1024 * 1024:  # 50MB
-                            self.send_attachment_to_telegram(attachment, message['id'])
+                            self.send_attachment_to_telegram(attachment, message['id'], route.chat_id)
                         else:
                             logging.warning(f"Anexo '{attachment['filename']}' muito grande para Telegram")
         
+        self.send_duplicate_summaries()
+        self.send_throttle_summaries()
+        self.log_filter_statistics()
+        
         # Atualiza timestamp da última verificação
         self.last_check_time = datetime.now()
         logging.info(f"Verificação concluída. Próxima em {self.config['settings']['check_interval_seconds']} segundos")
@@ -450,8 +3875,14 @@ class GmailTelegramForwarder:
         logging.info("Gmail to Telegram Forwarder iniciado!")
         logging.info(f"Verificando emails a cada {self.config['settings']['check_interval_seconds']} segundos")
         
+        # Recarrega filtros e ajustes quando o config.json muda
+        if self.config['settings'].get('reload_config', True):
+            self.config_watcher = ConfigWatcher(self.config_file, self.build_runtime)
+            self.config_watcher.start()
+        
         try:
             while True:
+                self.apply_config_update()
                 self.process_emails()
                 time.sleep(self.config['settings']['check_interval_seconds'])
                 
@@ -460,6 +3891,8 @@ class GmailTelegramForwarder:
         except Exception as e:
             logging.error(f"Erro inesperado: {e}")
             raise
+        finally:
+            self.close()
 
 def main():
     """Função principal"""
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Replay offline dos filtros do Gmail to Telegram Forwarder
+Executa filtros, roteamento, deduplicação e limite por remetente sobre um
+acervo local de emails, sem acessar Gmail nem Telegram
+
+Acervos aceitos:
+    - arquivo mbox
+    - diretório Maildir (com cur/, new/ e tmp/)
+    - diretório com arquivos .json (mensagens da Gmail API no formato 'full',
+      uma por arquivo ou uma lista por arquivo) e/ou arquivos .eml
+
+Uso:
+    python replay.py caixa.mbox
+    python replay.py exportacao/ --config config.json --verbose
+    python replay.py caixa.mbox --fit-priority pesos.json --target-label IMPORTANT
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import mailbox
+import argparse
+from collections import Counter, defaultdict
+from email import message_from_bytes
+from email.utils import parsedate_to_datetime
+
+import gmail_telegram_forwarder as gtf
+
+def encode(data):
+    """Codifica bytes como o campo 'data' da Gmail API"""
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def payload_from_part(part, message_id, counter):
+    """Converte uma parte MIME no formato de payload da Gmail API"""
+    payload = {
+        'mimeType': part.get_content_type(),
+        'filename': part.get_filename() or '',
+        'headers': [{'name': name, 'value': str(value)} for name, value in part.items()],
+    }
+    if part.is_multipart():
+        payload['body'] = {'size': 0}
+        payload['parts'] = [payload_from_part(child, message_id, counter)
+                            for child in part.get_payload()]
+        return payload
+
+    data = part.get_payload(decode=True) or b''
+    if payload['filename']:
+        # Anexos vêm só com id e tamanho, como na Gmail API
+        counter[0] += 1
+        payload['body'] = {'attachmentId': f'{message_id}.{counter[0]}', 'size': len(data)}
+    else:
+        # O forwarder lê o texto como UTF-8
+        if part.get_content_maintype() == 'text':
+            charset = part.get_content_charset() or 'utf-8'
+            try:
+                data = data.decode(charset, errors='replace').encode('utf-8')
+            except LookupError:
+                pass
+        payload['body'] = {'data': encode(data), 'size': len(data)}
+    return payload
+
+def message_from_email(email_message, message_id):
+    """Converte um email (email.message.Message) em mensagem da Gmail API"""
+    timestamp = None
+    date = email_message.get('Date')
+    if date:
+        try:
+            timestamp = parsedate_to_datetime(str(date)).timestamp()
+        except (TypeError, ValueError):
+            pass
+
+    # Exportações do Google Takeout trazem os marcadores neste cabeçalho
+    # ("Important,Category Updates" -> IMPORTANT, CATEGORY_UPDATES)
+    labels = [label.strip().upper().replace(' ', '_')
+              for label in str(email_message.get('X-Gmail-Labels', '')).split(',') if label.strip()]
+
+    payload = payload_from_part(email_message, message_id, [0])
+    return {
+        'id': message_id,
+        'labelIds': labels,
+        'internalDate': str(int(timestamp * 1000)) if timestamp is not None else None,
+        'sizeEstimate': len(email_message.as_bytes()),
+        'payload': payload,
+    }
+
+def load_json_messages(path):
+    """Lê mensagens da Gmail API de um arquivo .json (objeto ou lista)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    messages = data if isinstance(data, list) else [data]
+    for index, message in enumerate(messages):
+        message.setdefault('id', f'{os.path.basename(path)}#{index}')
+        yield message
+
+def load_corpus(path):
+    """Gera as mensagens do acervo no formato da Gmail API"""
+    if os.path.isdir(path):
+        if all(os.path.isdir(os.path.join(path, name)) for name in ('cur', 'new', 'tmp')):
+            for key, email_message in mailbox.Maildir(path, factory=None, create=False).items():
+                yield message_from_email(email_message, key)
+            return
+
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if name.endswith('.json'):
+                yield from load_json_messages(file_path)
+            elif name.endswith('.eml'):
+                with open(file_path, 'rb') as f:
+                    yield message_from_email(message_from_bytes(f.read()), name)
+        return
+
+    if path.endswith('.json'):
+        yield from load_json_messages(path)
+        return
+
+    for key, email_message in mailbox.mbox(path, create=False).items():
+        yield message_from_email(email_message, f'mbox#{key}')
+
+def message_time(message):
+    """Momento de recebimento da mensagem (segundos), se conhecido"""
+    internal_date = message.get('internalDate')
+    if internal_date:
+        return int(internal_date) / 1000
+    return None
+
+def print_counter(title, counter, limit=15):
+    """Imprime as entradas mais frequentes de um Counter"""
+    if not counter:
+        return
+    print(f"\n{title}:")
+    for name, count in counter.most_common(limit):
+        print(f"  {count:6d}  {name}")
+    if len(counter) > limit:
+        print(f"  ... e mais {len(counter) - limit}")
+
+def replay(forwarder, messages, verbose=False):
+    """Executa o pipeline sobre as mensagens e imprime o relatório"""
+    start = time.perf_counter()
+    options = forwarder.attachment_options
+    records = [(message, gtf.EmailRecord.from_message(message, options, forwarder.header_skip))
+               for message in messages]
+    loaded = time.perf_counter()
+
+    # Emails em ordem de recebimento, como chegariam ao forwarder
+    records.sort(key=lambda item: message_time(item[0]) or 0)
+
+    actions = Counter()
+    routes = Counter()
+    reasons = Counter()
+    rules = Counter()
+    matching_seconds = 0.0
+    decided = time.perf_counter()
+    for message, record in records:
+        delivery = forwarder.decide(record, now=message_time(message))
+        
+        # Contagem por regra fica fora da medição do pipeline
+        began = time.perf_counter()
+        rules.update(forwarder.filter_set.find_matches(record))
+        matching_seconds += time.perf_counter() - began
+        if delivery.action == 'forward':
+            # No replay todo envio é considerado bem-sucedido
+            forwarder.remember_forwarded(record, delivery, now=message_time(message))
+        record.compact()
+        actions[delivery.action] += 1
+        if delivery.route is not None:
+            routes[delivery.route.name] += 1
+        if delivery.reason:
+            reasons[delivery.reason] += 1
+        if verbose:
+            target = delivery.route.name if delivery.route is not None else '-'
+            print(f"{delivery.action:10s} {target:15s} {record.sender_address:35s} "
+                  f"{record.subject[:60]}" + (f"  ({delivery.reason})" if delivery.reason else ""))
+    finished = time.perf_counter()
+
+    total = len(records)
+    print("=" * 60)
+    print(f"📊 Replay de {total} emails")
+    print("=" * 60)
+    labels = {'forward': 'encaminhados', 'filtered': 'filtrados',
+              'duplicate': 'semelhantes suprimidos', 'throttled': 'retidos pelo limite'}
+    for action, label in labels.items():
+        count = actions[action]
+        share = count / total * 100 if total else 0.0
+        print(f"  {label:25s} {count:6d}  ({share:5.1f}%)")
+
+    print_counter("Destinos", routes)
+    print_counter("Motivos", reasons)
+    print_counter("Emails que casam com cada regra", rules)
+
+    statistics = [item for item in forwarder.filter_set.statistics() if item['calls']]
+    if statistics:
+        print("\nVerificações de filtro (ordem final):")
+        for item in statistics:
+            print(f"  {item['name']:40s} {item['calls']:6d} avaliações  "
+                  f"{item['reject_rate']:5.0%} rejeitados  {item['average_us']:7.1f} µs")
+
+    decide_seconds = finished - decided - matching_seconds
+    parse_seconds = loaded - start
+    print("\nDesempenho:")
+    if total:
+        print(f"  montagem dos registros {parse_seconds * 1000:8.1f} ms")
+        print(f"  pipeline completo      {decide_seconds * 1000:8.1f} ms  "
+              f"({total / decide_seconds if decide_seconds else 0:,.0f} emails/s)")
+    return actions
+
+def fit_priority(records, target_label, epochs=10, learning_rate=0.1, l2=1e-4, max_features=5000):
+    """Ajusta pesos de prioridade (regressão logística) sobre o acervo
+
+    Emails com o marcador ``target_label`` (ex.: IMPORTANT, STARRED) são os
+    exemplos positivos; o próprio marcador não é usado como atributo.
+
+    Returns:
+        dict: {'bias': ..., 'weights': {atributo: peso}} no formato de
+        ``settings.priority.weights_file``
+    """
+    target_feature = f"label:{target_label}"
+    samples = []
+    for record in records:
+        features = [feature for feature in gtf.priority_features(record) if feature != target_feature]
+        samples.append((features, 1.0 if target_label in record.labels else 0.0))
+
+    positives = sum(target for _, target in samples)
+    if not 0 < positives < len(samples):
+        raise ValueError(f"O acervo precisa de emails com e sem o marcador {target_label} "
+                         f"({int(positives)} de {len(samples)} têm o marcador)")
+
+    rate = positives / len(samples)
+    bias = math.log(rate / (1 - rate))
+    weights = defaultdict(float)
+    rng = random.Random(0)
+    for _ in range(epochs):
+        rng.shuffle(samples)
+        for features, target in samples:
+            z = max(-30.0, min(30.0, bias + sum(weights[feature] for feature in features)))
+            error = target - 1 / (1 + math.exp(-z))
+            bias += learning_rate * error
+            for feature in features:
+                weights[feature] += learning_rate * (error - l2 * weights[feature])
+
+    strongest = sorted(weights.items(), key=lambda item: -abs(item[1]))[:max_features]
+    return {'bias': round(bias, 4),
+            'weights': {feature: round(weight, 4) for feature, weight in strongest if abs(weight) >= 1e-3}}
+
+def report_fit(records, fitted, target_label, output):
+    """Imprime a qualidade do ajuste: positivos entre os mais bem pontuados"""
+    scorer = gtf.PriorityScorer(fitted['weights'], fitted['bias'])
+    start = time.perf_counter()
+    ranked, _ = scorer.order(records)
+    elapsed = time.perf_counter() - start
+
+    total = len(ranked)
+    positives = sum(1 for record in ranked if target_label in record.labels)
+    top = ranked[:max(1, total // 10)]
+    top_positives = sum(1 for record in top if target_label in record.labels)
+    print("=" * 60)
+    print(f"📊 Pesos de prioridade ajustados para {target_label}")
+    print("=" * 60)
+    print(f"  emails com o marcador      {positives:6d} de {total} ({positives / total:5.1%})")
+    print(f"  entre os 10% mais altos    {top_positives:6d} de {len(top)} ({top_positives / len(top):5.1%})")
+    print(f"  atributos salvos           {len(fitted['weights']):6d}")
+    print(f"  pontuação do lote          {elapsed * 1000:8.1f} ms "
+          f"({'NumPy' if gtf.numpy is not None else 'Python puro'})")
+    print(f"\n💾 Pesos salvos em {output}; use em settings.priority.weights_file")
+
+def main():
+    """Função principal do replay"""
+    parser = argparse.ArgumentParser(description="Replay offline dos filtros sobre um acervo de emails")
+    parser.add_argument('corpus', help="arquivo mbox, diretório Maildir ou diretório de .json/.eml")
+    parser.add_argument('--config', default='config.json', help="arquivo de configuração (padrão: config.json)")
+    parser.add_argument('--verbose', '-v', action='store_true', help="imprime a decisão de cada email")
+    parser.add_argument('--fit-priority', metavar='ARQUIVO',
+                        help="ajusta pesos de prioridade sobre o acervo e os salva em ARQUIVO")
+    parser.add_argument('--target-label', default='IMPORTANT',
+                        help="marcador do Gmail que indica email prioritário (padrão: IMPORTANT)")
+    args = parser.parse_args()
+
+    for path, label in ((args.corpus, "Acervo"), (args.config, "Arquivo de configuração")):
+        if not os.path.exists(path):
+            print(f"❌ {label} não encontrado: {path}")
+            sys.exit(1)
+
+    try:
+        forwarder = gtf.GmailTelegramForwarder(args.config, offline=True)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    messages = list(load_corpus(args.corpus))
+    print(f"📂 {len(messages)} emails lidos em {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    if args.fit_priority:
+        records = [gtf.EmailRecord.from_message(message) for message in messages]
+        try:
+            fitted = fit_priority(records, args.target_label)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        with open(args.fit_priority, 'w', encoding='utf-8') as f:
+            json.dump(fitted, f, indent=2, ensure_ascii=False)
+        report_fit(records, fitted, args.target_label, args.fit_priority)
+        return
+
+    replay(forwarder, messages, args.verbose)
+
+if __name__ == "__main__":
+    main()